@@ -0,0 +1,42 @@
+"""Compare the chunk-coalescing reader with h5py point selection.
+
+Run with: python3 -m benchmarks.chunked_reader
+"""
+from time import time
+
+import numpy as np
+from pandas import DataFrame
+
+
+def benchmark_read_block(dcm, sizes=(100, 10000, 100000), seed=0):
+    random = np.random.RandomState(seed)
+    n_signatures = dcm.matrix.shape[0]
+
+    data = []
+
+    for size in sizes:
+        indices = np.sort(random.choice(n_signatures, size, replace=False))
+
+        start = time()
+        expected = dcm.matrix[indices.tolist()]
+        h5py_time = time() - start
+
+        start = time()
+        block = dcm.reader.read_block(indices)
+        reader_time = time() - start
+
+        assert (block == expected).all()
+
+        data.append({
+            'signatures': size,
+            'h5py point selection [s]': h5py_time,
+            'read_block [s]': reader_time,
+            'speedup': h5py_time / reader_time
+        })
+
+    return DataFrame(data).set_index('signatures')
+
+
+if __name__ == '__main__':
+    from data_sources.drug_connectivity_map import dcm
+    print(benchmark_read_block(dcm))
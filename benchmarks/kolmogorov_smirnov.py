@@ -0,0 +1,48 @@
+"""Compare per-call times of the pandas and the compiled KS statistics.
+
+Run with: python3 -m benchmarks.kolmogorov_smirnov
+"""
+from timeit import timeit
+
+import numpy as np
+from pandas import DataFrame, Series
+
+from signature_scoring.scoring_functions.connectivity_score import (
+    create_kolmogorov_smirnov, create_generalized_kolmogorov_smirnov
+)
+
+
+def benchmark_kolmogorov_smirnov(n_genes=978, n_tags=250, repeats=100, seed=0):
+    random = np.random.RandomState(seed)
+    genes = [str(i).encode() for i in range(n_genes)]
+    instance = Series(random.randn(n_genes), index=genes).sort_values(ascending=False)
+    tags = Series(1, index=random.choice(genes, n_tags, replace=False))
+
+    variants = {
+        'kolmogorov_smirnov': create_kolmogorov_smirnov,
+        'generalized_kolmogorov_smirnov': create_generalized_kolmogorov_smirnov
+    }
+
+    data = []
+
+    for name, create in variants.items():
+        statistic = create()
+        compiled = create(compiled=True)
+
+        assert statistic(instance, tags) == compiled(instance, tags)
+
+        pandas_time = timeit(lambda: statistic(instance, tags), number=repeats) / repeats
+        compiled_time = timeit(lambda: compiled(instance, tags), number=repeats) / repeats
+
+        data.append({
+            'statistic': name,
+            'pandas [ms]': pandas_time * 1000,
+            'compiled [ms]': compiled_time * 1000,
+            'speedup': pandas_time / compiled_time
+        })
+
+    return DataFrame(data).set_index('statistic')
+
+
+if __name__ == '__main__':
+    print(benchmark_kolmogorov_smirnov())
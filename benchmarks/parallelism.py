@@ -0,0 +1,79 @@
+"""Compare the parallelism modes of the per-signature scoring (serial, threads, processes).
+
+The batch engines are disabled, so that each of the signatures is scored by a separate call.
+
+Run with: python3 -m benchmarks.parallelism
+"""
+from dataclasses import replace
+from time import time
+
+import numpy as np
+from pandas import DataFrame, Series
+
+from signature_scoring import score_signatures
+from signature_scoring.models import Signature
+from signature_scoring.processor import SignatureProcessor
+from signature_scoring.scoring_functions.connectivity_score import create_scorer, create_kolmogorov_smirnov
+from signature_scoring.scoring_functions.generic_scorers import x_sum
+
+
+class SyntheticSignaturesProcessor(SignatureProcessor):
+    # the scores of synthetic signatures cannot be linked to the metadata of CMap
+    scores_type = dict
+
+
+def benchmark_parallelism(
+    n_signatures=10000, n_genes=978, limit=250, processes=None,
+    modes=('serial', 'threads', 'processes'), seed=0
+):
+    random = np.random.RandomState(seed)
+    genes = [str(i).encode() for i in range(n_genes)]
+    query = Series(random.randn(n_genes), index=genes)
+    signatures = DataFrame(
+        random.randn(n_genes, n_signatures).astype(np.float32),
+        index=genes, columns=[f'S{i}' for i in range(n_signatures)]
+    )
+
+    scorers = {
+        'XSum': x_sum,
+        'KS': create_scorer(negative=True, statistic=create_kolmogorov_smirnov(compiled=True))
+    }
+
+    data = []
+
+    for name, scorer in scorers.items():
+        # compile the kernels before the measurements
+        score_signatures(
+            replace(scorer, batch=None, parallelism='serial'), query, signatures.iloc[:, :10],
+            limit=limit, processor_type=SyntheticSignaturesProcessor
+        )
+
+        expected = None
+        for mode in modes:
+            scoring_func = replace(scorer, batch=None, parallelism=mode)
+            # each of the modes starts with an empty cache
+            Signature.split.cache.clear()
+
+            start = time()
+            scores = score_signatures(
+                scoring_func, query, signatures, limit=limit, processes=processes,
+                processor_type=SyntheticSignaturesProcessor
+            )
+            elapsed = time() - start
+
+            if expected is None:
+                expected = scores
+            assert scores == expected
+
+            data.append({
+                'scorer': name,
+                'parallelism': mode,
+                'time [s]': elapsed,
+                'signatures per second': n_signatures / elapsed
+            })
+
+    return DataFrame(data).set_index(['scorer', 'parallelism'])
+
+
+if __name__ == '__main__':
+    print(benchmark_parallelism())
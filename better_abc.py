@@ -1,4 +1,5 @@
 from abc import abstractmethod, ABCMeta as NativeABCMeta
+from inspect import getattr_static
 
 
 abstract_method = abstractmethod
@@ -26,7 +27,8 @@ class ABCMeta(NativeABCMeta):
         abstract_attributes = {
             name
             for name in dir(instance)
-            if getattr(getattr(instance, name), '__is_abstract_attribute__', False)
+            # static lookup, so that (lazy) properties are not evaluated on construction
+            if getattr(getattr_static(instance, name), '__is_abstract_attribute__', False)
         }
         if abstract_attributes:
             raise NotImplementedError(
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class ChunkedReader:
+    """Reads scattered rows of a chunked HDF5 dataset, one chunk band at a time.
+
+    Passing thousands of indices to h5py (`dataset[indices]`) results in a point
+    selection which is very slow. Instead, the requested rows are grouped into runs
+    of neighbouring chunk bands; each run is read with a single hyperslab selection
+    (so every chunk is decompressed once) and the rows are scattered
+    into a preallocated output array.
+    """
+
+    def __init__(self, dataset, max_run_chunks=16):
+        self.dataset = dataset
+        # contiguous datasets have no chunks; for these runs of consecutive rows are coalesced
+        self.rows_per_chunk = dataset.chunks[0] if dataset.chunks else 1
+        self.max_run_chunks = max_run_chunks
+
+    def runs(self, sorted_indices):
+        """Yield (first, last) positions in sorted_indices delimiting rows read together"""
+        if not len(sorted_indices):
+            return
+        bands = sorted_indices // self.rows_per_chunk
+        breaks = np.flatnonzero(np.diff(bands)) + 1
+        starts = [0, *breaks]
+        ends = [*breaks, len(sorted_indices)]
+
+        run_start = 0
+        run_first_band = bands[0]
+        for start, end in zip(starts[1:], ends[1:]):
+            band = bands[start]
+            if band - bands[start - 1] != 1 or band - run_first_band >= self.max_run_chunks:
+                yield run_start, start
+                run_start = start
+                run_first_band = band
+        yield run_start, len(sorted_indices)
+
+    def read_block(self, indices, genes=None):
+        """Read rows of given indices (in the given order), optionally limited to selected columns.
+
+        Args:
+            indices: row (signature) indices; do not need to be sorted or unique
+            genes: positions of the columns (genes) to be retained
+        """
+        indices = np.asarray(indices, dtype=int)
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+
+        if genes is not None:
+            genes = np.asarray(genes, dtype=int)
+            # read only the span of columns covering the selected genes
+            columns = slice(genes.min(), genes.max() + 1) if len(genes) else slice(0, 0)
+            genes = genes - (columns.start or 0)
+            n_columns = len(genes)
+        else:
+            columns = slice(None)
+            n_columns = self.dataset.shape[1]
+
+        block = np.empty((len(indices), n_columns), dtype=self.dataset.dtype)
+
+        for first, last in self.runs(sorted_indices):
+            start = sorted_indices[first]
+            end = sorted_indices[last - 1] + 1
+            rows = self.dataset[start:end, columns][sorted_indices[first:last] - start]
+            if genes is not None:
+                rows = rows[:, genes]
+            block[order[first:last]] = rows
+
+        return block
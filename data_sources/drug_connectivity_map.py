@@ -1,49 +1,158 @@
 from functools import lru_cache
+from hashlib import sha1
+from itertools import chain
+from os import getpid
+from pathlib import Path
 import warnings
-from typing import List, Set
+from typing import List, Optional, Set
 from warnings import warn
 
-from pandas import read_table, DataFrame, Series, concat
+import numpy as np
+from diskcache import Cache
+from pandas import read_table, read_feather, DataFrame, Series, concat
+from pandas.api.types import CategoricalDtype, is_string_dtype
 from tqdm import tqdm
 
 from config import DATA_DIR
 from data_frames import MyDataFrame
+from data_sources.chunked_reader import ChunkedReader
 from data_sources.data_source import DataSource
+from data_sources.metadata_index import MetadataIndex
+from data_sources.rank_store import RankStore
+from data_sources.signature_store import SignatureStore
 from h5py import File
 from h5py.h5py_warnings import H5pyDeprecationWarning
 
 from helpers import first
-from helpers.cache import cached_property
+from helpers.cache import lazy_property, process_local_property
+from helpers.prefetch import Prefetcher
 
 
 warnings.simplefilter("ignore", H5pyDeprecationWarning)
 
 
+def write_categorical_cache(table: DataFrame, path: Path, max_unique_ratio=0.5):
+    """Save the table in feather format, storing repetitive text columns as categories"""
+    table = table.copy()
+    for column in table.columns:
+        values = table[column]
+        if is_string_dtype(values) and values.nunique() < max_unique_ratio * len(values):
+            table[column] = values.astype('category')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # other processes may be reading the cache: write aside and replace atomically
+        temporary_path = path.with_suffix(f'.{getpid()}.part')
+        table.to_feather(temporary_path)
+        temporary_path.replace(path)
+    except Exception as e:
+        # the cache is only an optimisation - parsing the text file works as well
+        warn(f'Could not cache {path.name}: {e}')
+
+
 class DrugConnectivityMap(DataSource):
+    """Level 5 signatures from LINCS/CMap with their metadata.
 
-    def __init__(self):
-        dataset_path = DATA_DIR + '/lincs/GSE92742'
+    Nothing is loaded on construction; the matrix file is opened and the
+    metadata tables are read on the first use. The tables are cached
+    in a binary columnar format (feather) so that subsequent sessions
+    (and pool workers) do not need to parse the gzipped text files again.
+    """
 
-        CMAP_PATH = dataset_path + '/GSE92742_Broad_LINCS_Level5_COMPZ.MODZ_n473647x12328.gctx'
-        self.cmap_file = File(CMAP_PATH, mode='r')
-        self.cmap = self.cmap_file['0']
-        self.cell_info = read_table(dataset_path + '/GSE92742_Broad_LINCS_cell_info.txt.gz', low_memory=False)
-        self.sig_metrics = read_table(dataset_path + '/GSE92742_Broad_LINCS_sig_metrics.txt.gz')
-        self.sig_index_vector = self.meta['COL']['id'].value
-        self.sig_index = {
+    def __init__(self, dataset_path=DATA_DIR + '/lincs/GSE92742', dtype=None):
+        """
+        Args:
+            dtype: type of the values returned by reads (e.g. float16 to halve the memory usage);
+                by default the type of the underlying matrix (float32) is retained
+        """
+        self.dataset_path = dataset_path
+        self.dtype = dtype
+        self.cmap_path = dataset_path + '/GSE92742_Broad_LINCS_Level5_COMPZ.MODZ_n473647x12328.gctx'
+        self.store_path = dataset_path + '/GSE92742_Broad_LINCS_Level5_COMPZ.MODZ_store'
+        self.cache_path = Path(dataset_path) / 'cache'
+
+    def read_table(self, name):
+        """Read GSE92742_Broad_LINCS_{name}.txt.gz, using the feather cache when up to date"""
+        path = Path(self.dataset_path) / f'GSE92742_Broad_LINCS_{name}.txt.gz'
+        cached_path = self.cache_path / f'{name}.feather'
+
+        if cached_path.exists() and cached_path.stat().st_mtime >= path.stat().st_mtime:
+            table = read_feather(cached_path)
+        else:
+            table = read_table(path, low_memory=False)
+            write_categorical_cache(table, cached_path)
+
+        # categorical dtypes are only used to keep the cache compact; in memory the
+        # original types are restored as groupby() on categories would change results
+        for column in table.columns:
+            if isinstance(table[column].dtype, CategoricalDtype):
+                table[column] = table[column].astype(object)
+        return table
+
+    @process_local_property
+    def cmap_file(self):
+        # HDF5 handles cannot be shared across fork(): each process opens the file on its own
+        return File(self.cmap_path, mode='r')
+
+    @process_local_property
+    def cmap(self):
+        return self.cmap_file['0']
+
+    @lazy_property
+    def store(self):
+        return SignatureStore(self.store_path) if SignatureStore.exists(self.store_path) else None
+
+    @process_local_property
+    def reader(self):
+        return ChunkedReader(self.matrix)
+
+    @lazy_property
+    def cell_info(self):
+        return self.read_table('cell_info')
+
+    @lazy_property
+    def sig_metrics(self):
+        return self.read_table('sig_metrics')
+
+    @lazy_property
+    def sig_info(self):
+        return self.read_table('sig_info')
+
+    @lazy_property
+    def sig_info_sig_id(self):
+        return self.sig_info.set_index('sig_id')
+
+    @lazy_property
+    def pert_info(self):
+        return self.read_table('pert_info')
+
+    @lazy_property
+    def sig_index_vector(self):
+        return self.meta['COL']['id'].value
+
+    @lazy_property
+    def sig_index(self):
+        return {
             sig_id: i
             for i, sig_id in enumerate(self.sig_index_vector)
         }
-        self.sig_info = read_table(dataset_path + '/GSE92742_Broad_LINCS_sig_info.txt.gz', low_memory=False)
-        self.sig_info_sig_id = self.sig_info.set_index('sig_id')
-        self.pert_info = read_table(dataset_path + '/GSE92742_Broad_LINCS_pert_info.txt.gz', low_memory=False)
+
+    @lazy_property
+    def metadata_index(self):
+        exemplars = self.sig_metrics.set_index('sig_id').is_exemplar.map(bool)
+        metadata = self.sig_info.assign(
+            is_exemplar=self.sig_info.sig_id.map(exemplars).fillna(False).values
+        )
+        return MetadataIndex(metadata)
 
     def signatures_treated_with(self, substance: str, pert_id=False):
         return self.metadata_for_perturbation(substance, pert_id=pert_id).sig_id
 
     def metadata_for_perturbation(self, substance: str, pert_id=False):
-        sig_info = self.sig_info
-        return sig_info[sig_info['pert_id' if pert_id else 'pert_iname'] == substance]
+        positions = self.metadata_index.lookup('pert_id' if pert_id else 'pert_iname', substance)
+        return self.sig_info.iloc[positions]
+
+    def metadata_for_signatures(self, signature_ids):
+        return self.sig_info.iloc[self.metadata_index.positions_of(signature_ids)]
 
     def all_signatures(self):
         return self.sig_info.sig_id
@@ -74,90 +183,263 @@ class DrugConnectivityMap(DataSource):
         return self.cmap['DATA']['0']['matrix']
 
     def signature_index(self, signature_id):
-        try:
-            if type(signature_id) is str:
-                signature_id = signature_id.encode('utf-8')
-            return self.sig_index[signature_id]
-        except IndexError:
-            print(
-                f'Failed to find signature: {signature_id},'
-                f'likely due to concurrency issues, retrying'
-            )
-            return self.signature_index(signature_id)
+        if type(signature_id) is str:
+            signature_id = signature_id.encode('utf-8')
+        return self.sig_index[signature_id]
+
+    def convert_to_store(self, path=None, dtype='float32'):
+        """Write the signatures matrix into a memory-mapped store (one-time operation);
+
+        once the store exists, profiles are served as views of the memmap
+        rather than decompressed and copied from the GCTX file.
+        """
+        path = path or self.store_path
+        self.store = SignatureStore.convert(
+            self.matrix, self.entrez_gene_ids, self.sig_index_vector, path, dtype=dtype
+        )
+        return self.store
+
+    @lazy_property
+    def subset_stores(self):
+        """Stores with subsets of genes (e.g. landmark genes), by name"""
+        path = Path(self.store_path + '.subsets')
+        if not path.exists():
+            return {}
+        return {
+            store_path.name: SignatureStore(store_path)
+            for store_path in sorted(path.iterdir())
+            if SignatureStore.exists(store_path)
+        }
+
+    def create_subset_store(self, name, genes, dtype='float32'):
+        """Precompute a store holding only the selected genes (for all signatures);
+
+        reads limited to these genes (or their subsets) will use the smaller store.
+        """
+        positions = self.gene_positions(genes)
+        source = self.store.matrix if self.store else self.matrix
+        store = SignatureStore.convert(
+            source, self.entrez_gene_ids[positions], self.sig_index_vector,
+            Path(self.store_path + '.subsets') / name, dtype=dtype, columns=positions
+        )
+        self.subset_stores[name] = store
+        return store
+
+    def store_for(self, genes=None):
+        """The smallest store including all the genes (given as positions) and positions of the genes in that store"""
+        if genes is not None:
+            gene_ids = self.entrez_gene_ids[genes]
+            for store in sorted(self.subset_stores.values(), key=lambda store: len(store.genes)):
+                columns = store.columns_of(gene_ids)
+                if columns is not None:
+                    return store, columns
+        return self.store, genes
+
+    @lazy_property
+    def rank_stores(self):
+        """Stores with precomputed ranks of the profiles, by the key of their set of genes"""
+        path = Path(self.store_path + '.ranks')
+        if not path.exists():
+            return {}
+        return {
+            store_path.name: RankStore(store_path)
+            for store_path in sorted(path.iterdir())
+            if RankStore.exists(store_path)
+        }
 
-    def profile_by_signature(self, signature_id):
-        column_index = self.signature_index(signature_id)
-        return self.matrix[column_index]
+    def create_rank_store(self, genes=None, signature_ids=None, block_size=1000):
+        """Precompute the ranks of the profiles over the genes (Entrez ids; all genes by default)
+        of the signatures (all signatures by default); one-time operation for each set of genes.
 
-    def profiles_by_signatures(self, signature_ids):
+        Scorers ranking whole compound profiles (e.g. the connectivity score with
+        ranks_type='signature') will then read the ranks instead of computing these.
+        """
+        positions = None if genes is None else self.gene_positions(genes)
+        genes = self.entrez_gene_ids if positions is None else self.entrez_gene_ids[positions]
+        if signature_ids is None:
+            signature_ids = [RankStore.signature_key(signature_id) for signature_id in self.sig_index_vector]
+        signature_ids = list(signature_ids)
+        blocks = (
+            block.values
+            for block in self.iterate_blocks(signature_ids, genes=genes, block_size=block_size)
+        )
+        # the type of the values as read (the ranks will only be used for profiles of the same type)
+        first_block = next(blocks)
+        key = RankStore.key(genes)
+        store = RankStore.convert(
+            chain([first_block], blocks), genes, signature_ids, Path(self.store_path + '.ranks') / key,
+            dtype=first_block.dtype
+        )
+        self.rank_stores[key] = store
+        return store
+
+    def rank_store_for(self, genes, signature_ids, dtype) -> Optional[RankStore]:
+        """Store with the ranks over exactly these genes, for all the signatures (if one was created)
+
+        Args:
+            dtype: type of the values of the profiles to be ranked (as read, before any conversions)
+        """
+        store = self.rank_stores.get(RankStore.key(genes))
+        if store is None or not store.suits(signature_ids, dtype):
+            return None
+        return store
+
+    def profile_by_signature(self, signature_id, genes=None):
+        """Profile of the signature, optionally limited to genes at given positions"""
+        return self.read_block([self.signature_index(signature_id)], genes=genes)[0]
+
+    def read_block(self, indices, genes=None):
+        """Read profiles of signatures at given (sorted) indices.
+
+        Args:
+            indices: positions of the signatures in the matrix
+            genes: positions of the genes to be retained (all genes by default)
+        """
+        store, columns = self.store_for(genes)
+        if store:
+            block = store.rows(indices)
+            if columns is not None:
+                block = block[:, columns]
+        else:
+            block = self.reader.read_block(indices, genes=genes)
+        if self.dtype is not None:
+            block = block.astype(self.dtype, copy=False)
+        return block
+
+    def profiles_by_signatures(self, signature_ids, genes=None):
         indices_map = {
             signature_id: self.signature_index(signature_id)
             for signature_id in signature_ids
         }
         indices = sorted(indices_map.values())
-        return self.matrix[indices], sorted(indices_map, key=indices_map.get)
+        return self.read_block(indices, genes=genes), sorted(indices_map, key=indices_map.get)
 
-    @cached_property
+    @lazy_property
     def entrez_gene_ids(self):
         return self.meta['ROW']['id'].value
 
-    def from_ids(self, signature_ids: Series, filter=True, **kwargs):
+    @lazy_property
+    def gene_index(self):
+        return {
+            gene: i
+            for i, gene in enumerate(self.entrez_gene_ids)
+        }
+
+    def gene_positions(self, genes):
+        """Sorted positions of given genes (Entrez ids as str, bytes or int); unknown genes are skipped"""
+        gene_index = self.gene_index
+        return np.unique([
+            gene_index[gene]
+            for gene in (
+                gene if type(gene) is bytes else str(gene).encode()
+                for gene in genes
+            )
+            if gene in gene_index
+        ]).astype(int)
+
+    @lazy_property
+    def gene_info(self):
+        return self.read_table('gene_info')
+
+    @property
+    def landmark_genes(self):
+        gene_info = self.gene_info
+        return [str(gene).encode() for gene in gene_info[gene_info.pr_is_lm == 1].pr_gene_id]
+
+    def from_ids(self, signature_ids: Series, filter=True, genes=None, **kwargs):
+        """Profiles of the signatures as a data frame (genes x signatures).
+
+        Args:
+            genes: Entrez ids of the genes to be read (all genes by default);
+                only the requested genes are read from the signatures store
+        """
         if filter:
             signature_ids = self.filter_signatures(signature_ids, **kwargs)
+        positions = None if genes is None else self.gene_positions(genes)
+        index = self.entrez_gene_ids if positions is None else self.entrez_gene_ids[positions]
         if not signature_ids:
-            return DataFrame(index=self.entrez_gene_ids, columns=signature_ids)
-        data, ordered_ids = self.profiles_by_signatures(signature_ids)
+            return DataFrame(index=index, columns=signature_ids)
+        data, ordered_ids = self.profiles_by_signatures(signature_ids, genes=positions)
         return SignaturesData(
             data.T,
-            index=self.entrez_gene_ids,
+            index=index,
             columns=ordered_ids
         )
 
-    def from_id(self, signature_id):
-        index = self.signature_index(signature_id)
-        data = self.matrix[index]
-        return Series(data.T, index=self.entrez_gene_ids, name=signature_id)
+    def from_id(self, signature_id, genes=None):
+        positions = None if genes is None else self.gene_positions(genes)
+        index = self.entrez_gene_ids if positions is None else self.entrez_gene_ids[positions]
+        data = self.profile_by_signature(signature_id, genes=positions)
+        return Series(data.T, index=index, name=signature_id)
+
+    def read_blocks(self, signature_ids, genes=None, block_size=256):
+        for start in range(0, len(signature_ids), block_size):
+            block_ids = signature_ids[start:start + block_size]
+            block = self.from_ids(block_ids, filter=False, genes=genes)
+            # restore the order of the signatures (the profiles are read in the order of the matrix)
+            yield block[block_ids]
+
+    def iterate_blocks(self, signature_ids, genes=None, block_size=256, prefetch=2):
+        """Profiles of the signatures in blocks (genes x signatures), in the given order.
+
+        The blocks are read ahead of the consumer on a background thread,
+        so that the reads overlap with the processing of the previous blocks.
 
-    def iterate_signatures(self, signature_ids):
-        for signature_id in signature_ids:
-            index = self.signature_index(signature_id)
-            data = self.matrix[index]
-            yield SignaturesData(data.T, index=self.entrez_gene_ids, columns=[signature_id])
+        Args:
+            prefetch: number of blocks to be read ahead
+        """
+        signature_ids = list(signature_ids)
+        blocks = self.read_blocks(signature_ids, genes=genes, block_size=block_size)
+        if not prefetch:
+            yield from blocks
+            return
+        with Prefetcher(blocks, depth=prefetch) as blocks:
+            yield from blocks
+
+    def iterate_signatures(self, signature_ids, genes=None, block_size=256, prefetch=2):
+        for block in self.iterate_blocks(signature_ids, genes=genes, block_size=block_size, prefetch=prefetch):
+            for i in range(block.shape[1]):
+                yield block.iloc[:, [i]]
 
     def ids_of_exemplars(self, cell_id=None, take_first_per_pert=False):
-        metrics = self.sig_metrics
-        selected = metrics[metrics.is_exemplar.map(bool)]
+        conditions = {'is_exemplar': True}
         if cell_id:
-            selected = selected.merge(self.sig_info)
-            selected = selected[selected.cell_id == cell_id]
+            conditions['cell_id'] = cell_id
+        selected = self.sig_info.iloc[self.metadata_index.select(**conditions)]
         if take_first_per_pert:
             selected = selected.drop_duplicates(subset=['pert_id'])
         return selected.sig_id
 
     def filter_signatures(self, signatures: Series, exemplar_only=True, limit_to_one=False, **kwargs):
-        signatures = Series(signatures)
+        conditions = {
+            key: value
+            for key, value in kwargs.items()
+            if value is not None
+        }
+
+        if not (exemplar_only or conditions or limit_to_one):
+            return Series(signatures).tolist()
+
+        index = self.metadata_index
+        positions = index.positions_of(signatures)
+
         if exemplar_only:
-            metrics = self.sig_metrics
-            signature_metrics = metrics[metrics.sig_id.isin(signatures)]
-            exemplar_signature_metrics = signature_metrics[signature_metrics.is_exemplar.map(bool)]
-            if not exemplar_signature_metrics.empty:
-                signatures = exemplar_signature_metrics['sig_id']
-
-        for key, value in kwargs.items():
-            if value is None:
-                continue
-            signatures_data = self.sig_info[self.sig_info.sig_id.isin(signatures)]
-            signatures = signatures_data[signatures_data[key] == value]['sig_id']
+            exemplars = index.select(positions, is_exemplar=True)
+            if len(exemplars):
+                positions = exemplars
+
+        if conditions:
+            positions = index.select(positions, **conditions)
+
+        signatures_data = self.sig_info.iloc[positions]
 
         if limit_to_one:
-            signatures_data = self.sig_info[self.sig_info.sig_id.isin(signatures)]
             signatures_data = signatures_data.sort_values(
                 ['pert_idose', 'pert_time', 'cell_id'],
                 ascending=[False, False, False]
             )
-            signatures = list(signatures_data.sig_id)
-            signatures = Series(signatures[:1])
-        return signatures.tolist()
+            signatures_data = signatures_data.head(1)
+        return signatures_data.sig_id.tolist()
 
     def ids_for_perturbations(self, substances, synonyms_source=None, pert_id=False, **kwargs):
         chosen_signatures = []
@@ -181,7 +463,7 @@ class DrugConnectivityMap(DataSource):
 
     def from_perturbations(
         self, substances, synonyms_source=None, exemplar_only=True,
-        cell_id=None, limit_to_one=False, pert_id=False
+        cell_id=None, limit_to_one=False, pert_id=False, genes=None
     ):
         chosen_signatures = self.ids_for_perturbations(
             substances, synonyms_source=synonyms_source,
@@ -207,7 +489,7 @@ class DrugConnectivityMap(DataSource):
             f'{(len(matched)/len(substances) if len(substances) else 0)*100:.2f}% '
             f'of substances. {no_matches}'
         )
-        return self.from_ids(chosen_signatures, filter=False)
+        return self.from_ids(chosen_signatures, filter=False, genes=genes)
 
     cache = {}
 
@@ -231,32 +513,29 @@ class DrugConnectivityMap(DataSource):
         ]
         return concat([get_controls(consensus=consensus) for get_controls in controls])
 
+    def vehicle_controls(self, cell_id, pert_itime, exemplar_only=False):
+        """DMSO signatures from the same cell line and time point"""
+        signatures = self.signatures_treated_with('DMSO')
+
+        return self.filter_signatures(
+            signatures, pert_type='ctl_vehicle', pert_itime=pert_itime,
+            cell_id=cell_id, exemplar_only=exemplar_only
+        )
+
     def get_controls(self, signature_id, limit_to_genes=None, exemplar_only=False):
         """
         Documentation from LINCS states that DMSO is the control for compound treatments,
         while empty vectors and other non-gene-coding inserts (e.g LacZ) are controls
         for genetic perturbagens.
         """
-        sig_data = self.sig_info[self.sig_info.sig_id == signature_id].squeeze()
-        cell_id = sig_data.cell_id
-        pert_itime = sig_data.pert_itime
+        sig_data = self.metadata_for_signatures([signature_id]).squeeze()
 
         if sig_data.pert_type == 'trt_cp':  # compound treatment
-            pert_type = 'ctl_vehicle'
-            pert_iname = 'DMSO'
+            signatures = self.vehicle_controls(sig_data.cell_id, sig_data.pert_itime, exemplar_only)
         else:
             # TODO: how should I choose adequate vector?
-            pert_type = 'ctl_vector'
-            pert_iname = None
             assert False
 
-        signatures = self.signatures_treated_with(pert_iname)
-
-        signatures = self.filter_signatures(
-            signatures, pert_type=pert_type, pert_itime=pert_itime,
-            cell_id=cell_id, exemplar_only=exemplar_only
-        )
-
         controls = self.from_ids(signatures, filter=False)
 
         if limit_to_genes is not None:
@@ -264,9 +543,76 @@ class DrugConnectivityMap(DataSource):
 
         return controls
 
+    @lazy_property
+    def controls_cache(self):
+        return Cache(str(self.cache_path / 'controls'))
+
+    def control_mean(self, cell_id, pert_itime, genes=None, exemplar_only=True):
+        """Mean of the vehicle controls for given cell line and time point (None if there are no controls).
+
+        The means are stored in an on-disk cache (safe for concurrent use by multiple processes),
+        addressed by the hash of the cell line, time point, exemplar_only, the set of genes
+        and the precision the profiles are read with (the means differ between the precisions).
+        """
+        key = sha1(repr((
+            Path(self.cmap_path).name, cell_id, pert_itime, bool(exemplar_only),
+            None if self.dtype is None else str(np.dtype(self.dtype)),
+            None if genes is None else sha1(b'\0'.join(sorted(
+                gene if type(gene) is bytes else str(gene).encode()
+                for gene in genes
+            ))).hexdigest()
+        )).encode()).hexdigest()
+
+        cache = self.controls_cache
+        if key in cache:
+            return cache[key]
+
+        controls = self.from_ids(self.vehicle_controls(cell_id, pert_itime, exemplar_only), filter=False, genes=genes)
+
+        mean = None if controls.empty else controls.mean(axis=1)
+        cache[key] = mean
+        return mean
+
+    def control_means(self, signature_ids, genes=None, exemplar_only=True) -> DataFrame:
+        """Mean control profile for each of the signatures.
+
+        Signatures sharing the cell line and time point share the controls;
+        the mean of each group of controls is computed only once.
+        Signatures without controls are skipped.
+
+        Returns:
+            genes x signatures data frame, with columns in the order of signature_ids
+        """
+        metadata = self.metadata_for_signatures(signature_ids)
+        assert (metadata.pert_type == 'trt_cp').all()
+
+        means = []
+        mean_by_signature = {}
+
+        for (cell_id, pert_itime), group in metadata.groupby(['cell_id', 'pert_itime']):
+            mean = self.control_mean(cell_id, pert_itime, genes, exemplar_only)
+            if mean is None:
+                continue
+            for signature_id in group.sig_id:
+                mean_by_signature[signature_id] = len(means)
+            means.append(mean)
+
+        signature_ids = [
+            signature_id
+            for signature_id in signature_ids
+            if signature_id in mean_by_signature
+        ]
+
+        if not means:
+            return DataFrame(columns=signature_ids)
+
+        unique_means = concat(means, axis=1)
+        controls = unique_means.iloc[:, [mean_by_signature[signature_id] for signature_id in signature_ids]]
+        controls.columns = signature_ids
+        return controls
+
     def identify_substances(self, signature_ids):
-        ids = set(signature_ids)
-        return set(self.sig_info[self.sig_info.sig_id.isin(ids)].pert_iname)
+        return set(self.metadata_for_signatures(signature_ids).pert_iname)
 
 
 from collections import UserDict
@@ -380,8 +726,7 @@ class SignaturesData(MyDataFrame):
         return self.progress_apply(diff, axis=0)
 
     def classes(self, class_type='pert_iname'):
-        metadata = dcm.sig_info[dcm.sig_info.sig_id.isin(self.columns)]
-        return metadata[class_type]
+        return self.metadata[class_type]
 
     def ordered_classes(self, class_type='pert_iname'):
         metadata = dcm.sig_info_sig_id.loc[self.columns]
@@ -389,7 +734,7 @@ class SignaturesData(MyDataFrame):
 
     @property
     def metadata(self):
-        return dcm.sig_info[dcm.sig_info.sig_id.isin(self.columns)]
+        return dcm.metadata_for_signatures(self.columns)
 
     def members_of_class(self, class_name, class_type='pert_iname', cell_line=None):
         metadata = self.metadata
@@ -425,21 +770,8 @@ class SignaturesData(MyDataFrame):
         return self[selected_signatures]
 
 
-dcm = DrugConnectivityMap()
-
-
 @lru_cache()
 def get_controls_for_signatures(ids, genes_to_keep=None):
-    controls_by_signature = {}
-    for signature_id in ids:
-        controls = dcm.get_controls(signature_id, exemplar_only=True)
-        if genes_to_keep is not None:
-            rows_to_keep = controls.index.isin(genes_to_keep)
-            controls = controls[rows_to_keep]
-        if controls.empty:
-            continue
-        control = controls.mean(axis=1)
-        controls_by_signature[signature_id] = control
-    df = DataFrame(controls_by_signature)
+    df = dcm.control_means(ids, genes=genes_to_keep, exemplar_only=True)
     assert df.notna().all().all()
     return df
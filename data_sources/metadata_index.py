@@ -0,0 +1,86 @@
+from functools import reduce
+from typing import Iterable
+
+import numpy as np
+from pandas import DataFrame, factorize
+
+
+class MetadataIndex:
+    """Inverted index over signatures metadata.
+
+    For each of the indexed columns, maps every distinct value to a sorted array
+    of positions (rows of the metadata table) having this value, so that
+    conjunctive filters become intersections of (small) integer arrays
+    rather than boolean scans over the whole table.
+    """
+
+    indexed_columns = ['pert_iname', 'pert_id', 'cell_id', 'pert_type', 'pert_itime', 'pert_idose', 'is_exemplar']
+
+    empty = np.empty(0, dtype=int)
+
+    def __init__(self, metadata: DataFrame, columns=None):
+        self.metadata = metadata
+        self.positions = {
+            sig_id: i
+            for i, sig_id in enumerate(metadata.sig_id)
+        }
+        self.index = {
+            column: self.invert(metadata[column])
+            for column in (columns or self.indexed_columns)
+        }
+
+    @staticmethod
+    def invert(column):
+        codes, values = factorize(column)
+        # stable sort keeps positions sorted within each of the values
+        order = np.argsort(codes, kind='stable')
+        boundaries = np.searchsorted(codes[order], np.arange(len(values) + 1))
+        return {
+            value: order[boundaries[i]:boundaries[i + 1]]
+            for i, value in enumerate(values)
+        }
+
+    def lookup(self, column, value) -> np.ndarray:
+        return self.index[column].get(value, self.empty)
+
+    def positions_of(self, signature_ids: Iterable) -> np.ndarray:
+        """Sorted positions of given signatures; unknown signatures are skipped"""
+        positions = self.positions
+        return np.unique([
+            positions[signature_id]
+            for signature_id in (
+                s.decode() if type(s) is bytes else s
+                for s in signature_ids
+            )
+            if signature_id in positions
+        ]).astype(int)
+
+    def select(self, positions: np.ndarray = None, **conditions) -> np.ndarray:
+        """Positions of signatures fulfilling all the conditions (column=value),
+
+        optionally limited to the given (sorted) positions.
+        Conditions on columns which are not indexed are resolved by a scan over
+        the positions selected by the indexed conditions.
+        """
+        arrays = [
+            self.lookup(column, value)
+            for column, value in conditions.items()
+            if column in self.index
+        ]
+        if positions is not None:
+            arrays.append(positions)
+
+        if arrays:
+            # intersect starting from the smallest arrays
+            selected = reduce(
+                lambda a, b: np.intersect1d(a, b, assume_unique=True),
+                sorted(arrays, key=len)
+            )
+        else:
+            selected = np.arange(len(self.metadata))
+
+        for column, value in conditions.items():
+            if column not in self.index:
+                selected = selected[self.metadata[column].values[selected] == value]
+
+        return selected
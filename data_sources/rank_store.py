@@ -0,0 +1,118 @@
+import json
+from hashlib import sha1
+from pathlib import Path
+
+import numpy as np
+from scipy.stats import rankdata
+from tqdm import tqdm
+
+
+class RankStore:
+    """Precomputed ranks of the signature profiles over a fixed subset of genes.
+
+    The ranks of a compound profile do not depend on the disease, thus
+    can be computed once (for a given set of genes) and shared by all the
+    scorers, workers and sessions through a memory-mapped .npy file.
+
+    The ranks are stored doubled (the average ranks of ties are multiples
+    of 0.5) as uint16, in the increasing order of values (as scipy.stats.rankdata),
+    one row per signature. The store is identified by the key of its set of genes.
+    """
+
+    ranks_file = 'ranks.npy'
+    genes_file = 'genes.npy'
+    signatures_file = 'signatures.npy'
+    meta_file = 'meta.json'
+
+    max_genes = np.iinfo(np.uint16).max // 2
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.ranks = np.load(self.path / self.ranks_file, mmap_mode='r')
+        self.genes = np.load(self.path / self.genes_file)
+        self.signatures = np.load(self.path / self.signatures_file)
+        self.meta = json.loads((self.path / self.meta_file).read_text())
+        self.gene_index = {
+            gene: i
+            for i, gene in enumerate(self.genes.tolist())
+        }
+        self.signature_index = {
+            signature: i
+            for i, signature in enumerate(self.signatures.tolist())
+        }
+        assert self.ranks.shape == (len(self.signatures), len(self.genes))
+
+    @staticmethod
+    def normalize(genes):
+        return [gene if type(gene) is bytes else str(gene).encode() for gene in genes]
+
+    @staticmethod
+    def signature_key(signature_id) -> str:
+        return signature_id.decode() if type(signature_id) is bytes else signature_id
+
+    @classmethod
+    def key(cls, genes) -> str:
+        """Identifier of a set of genes (independent of their order)"""
+        return sha1(b'\n'.join(sorted(cls.normalize(genes)))).hexdigest()
+
+    @classmethod
+    def exists(cls, path):
+        return (Path(path) / cls.ranks_file).exists()
+
+    @classmethod
+    def convert(cls, blocks, genes, signatures, path, dtype=None, progress=True):
+        """One-time computation of the ranks of the profiles given in blocks (genes x signatures).
+
+        The blocks have to follow the order of signatures; the ranks file is written
+        under a temporary name and renamed only once complete.
+
+        Args:
+            dtype: type of the values the ranks were computed from (ties depend on the precision)
+        """
+        genes = np.asarray(cls.normalize(genes))
+        assert len(genes) <= cls.max_genes
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        np.save(path / cls.genes_file, genes)
+        np.save(path / cls.signatures_file, np.asarray([cls.signature_key(signature) for signature in signatures]))
+        (path / cls.meta_file).write_text(json.dumps({'dtype': str(np.dtype(dtype)) if dtype else None}))
+
+        temporary_path = path / (cls.ranks_file + '.part')
+        store = np.lib.format.open_memmap(
+            temporary_path, mode='w+', dtype=np.uint16, shape=(len(signatures), len(genes))
+        )
+
+        if progress:
+            blocks = tqdm(blocks)
+
+        start = 0
+        for block in blocks:
+            end = start + block.shape[1]
+            store[start:end] = (rankdata(block, axis=0) * 2).T
+            start = end
+        assert start == len(signatures)
+
+        store.flush()
+        del store
+        temporary_path.rename(path / cls.ranks_file)
+
+        return cls(path)
+
+    def includes(self, signature_ids) -> bool:
+        return all(self.signature_key(signature_id) in self.signature_index for signature_id in signature_ids)
+
+    def suits(self, signature_ids, dtype) -> bool:
+        """Whether the store holds the ranks of these signatures, computed from values of the same type
+
+        (ties depend on the precision of the values; values cast to another type, e.g. in the
+        precision benchmarks, have to be ranked again)"""
+        return self.meta['dtype'] == str(np.dtype(dtype)) and self.includes(signature_ids)
+
+    def ascending_ranks(self, signature_ids, genes) -> np.ndarray:
+        """Ranks (as by rankdata) of the genes (all genes of the store, in any order)
+        in the profiles of given signatures, as a (genes x signatures) matrix"""
+        rows = [self.signature_index[self.signature_key(signature_id)] for signature_id in signature_ids]
+        columns = [self.gene_index[gene] for gene in self.normalize(genes)]
+        return self.ranks[rows][:, columns].T / 2
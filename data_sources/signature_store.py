@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+
+class SignatureStore:
+    """Signature-major, memory-mapped copy of the Level 5 signatures matrix.
+
+    Reading from GCTX goes through h5py: every access decompresses
+    the chunks and fancy indexing copies the data. The store keeps
+    the very same matrix (one row per signature) as a contiguous
+    .npy file, so that rows can be served as views of the memmap.
+
+    Sidecar files hold the gene (columns) and signature (rows) identifiers,
+    in the same order as in the GCTX file.
+    """
+
+    matrix_file = 'matrix.npy'
+    genes_file = 'genes.npy'
+    signatures_file = 'signatures.npy'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.matrix = np.load(self.path / self.matrix_file, mmap_mode='r')
+        self.genes = np.load(self.path / self.genes_file)
+        self.signatures = np.load(self.path / self.signatures_file)
+        self.gene_index = {
+            gene: i
+            for i, gene in enumerate(self.genes)
+        }
+        assert self.matrix.shape == (len(self.signatures), len(self.genes))
+
+    @classmethod
+    def exists(cls, path):
+        return (Path(path) / cls.matrix_file).exists()
+
+    @classmethod
+    def convert(
+        cls, matrix, genes, signatures, path, dtype='float32', block_size=10000, progress=True,
+        columns=None
+    ):
+        """One-time conversion of the (h5py) matrix into the store.
+
+        The matrix is copied in blocks of rows so that the memory usage stays bounded;
+        the matrix file is written under a temporary name and renamed only once complete.
+
+        Args:
+            columns: positions of the genes to be copied, when creating a store
+                for a subset of genes (genes should then list the selected genes only)
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        np.save(path / cls.genes_file, np.asarray(genes))
+        np.save(path / cls.signatures_file, np.asarray(signatures))
+
+        n_signatures = matrix.shape[0]
+        n_genes = matrix.shape[1] if columns is None else len(columns)
+        assert n_signatures == len(signatures) and n_genes == len(genes)
+
+        temporary_path = path / (cls.matrix_file + '.part')
+        store = np.lib.format.open_memmap(
+            temporary_path, mode='w+', dtype=dtype, shape=(n_signatures, n_genes)
+        )
+
+        blocks = range(0, n_signatures, block_size)
+        if progress:
+            blocks = tqdm(blocks)
+
+        for start in blocks:
+            end = min(start + block_size, n_signatures)
+            block = matrix[start:end]
+            store[start:end] = block if columns is None else block[:, columns]
+
+        store.flush()
+        del store
+        temporary_path.rename(path / cls.matrix_file)
+
+        return cls(path)
+
+    def columns_of(self, genes):
+        """Positions of the genes in this store or None if any of the genes is not included"""
+        try:
+            return np.array([self.gene_index[gene] for gene in genes], dtype=int)
+        except KeyError:
+            return None
+
+    def row(self, index):
+        """A view of a single signature profile (no copy)"""
+        return self.matrix[index]
+
+    def rows(self, indices):
+        """Profiles of given signatures, in the order of the indices.
+
+        A contiguous increasing run of indices is returned as a view; other
+        indices (scattered, unsorted or repeated) require gathering the rows
+        into a new array (a single memory copy, without decompression).
+        """
+        indices = np.asarray(indices)
+        if not len(indices):
+            return self.matrix[:0]
+        if np.all(np.diff(indices) == 1):
+            return self.matrix[indices[0]:indices[-1] + 1]
+        return self.matrix[indices]
@@ -1,7 +1,13 @@
+from collections import OrderedDict
 from pandas.util import hash_pandas_object
 from pandas import DataFrame, Series
 from copy import copy
 from hashlib import sha512
+from os import getpid
+from sys import getsizeof
+from threading import RLock
+
+import numpy as np
 
 
 def deep_hash(item):
@@ -99,6 +105,112 @@ def series_method_args_to_hashable(args, kwargs):
 fast_series_cache_decorator = cache_generator(series_method_args_to_hashable)
 
 
+def size_in_bytes(value):
+    """Approximate memory footprint of (tuples/lists of) pandas objects and arrays"""
+    if isinstance(value, (Series, DataFrame)):
+        return int(np.sum(value.memory_usage(index=True, deep=False)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return getsizeof(value) + sum(size_in_bytes(item) for item in value)
+    return getsizeof(value)
+
+
+class BoundedCache:
+    """Least-recently-used cache limited by the (approximate) size of the stored values.
+
+    Values larger than the whole budget are not stored. The budget applies
+    to each process separately (forked workers get a copy of the cache);
+    the threads of a process share the cache.
+    """
+
+    def __init__(self, max_bytes, sizeof=size_in_bytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.lock = RLock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = value, size
+            self.size += size
+            self.shrink()
+
+    def shrink(self):
+        with self.lock:
+            while self.size > self.max_bytes:
+                _, size = self.entries.popitem(last=False)[1]
+                self.size -= size
+                self.evictions += 1
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.shrink()
+
+    def clear(self):
+        """Remove all entries and reset the counters (e.g. between benchmark phases)"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return {
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def bounded_cache_generator(make_hashable):
+
+    def bounded_cache_decorator(max_bytes):
+
+        def cache_decorator_closure(function):
+            cache = BoundedCache(max_bytes)
+            missing = object()
+
+            def cached(*args, **kwargs):
+                hashable = make_hashable(args, kwargs)
+                result = cache.get(hashable, missing)
+                if result is missing:
+                    result = function(*args, **kwargs)
+                    cache.put(hashable, result)
+                return result
+
+            cached.original_function = function
+            cached.cache = cache
+
+            return cached
+
+        return cache_decorator_closure
+
+    return bounded_cache_decorator
+
+
+bounded_series_cache_decorator = bounded_cache_generator(series_method_args_to_hashable)
+
+
 def cached_property(function):
     
     def cached(self, *args, **kwargs):
@@ -110,3 +222,45 @@ def cached_property(function):
         return function.__cache__[hashable]
     
     return property(cached)
+
+
+class lazy_property:
+    """Compute the value on the first access and store it on the instance,
+
+    so that subsequent accesses (and assignments) bypass the descriptor.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.function(instance)
+        instance.__dict__[self.function.__name__] = value
+        return value
+
+
+class process_local_property:
+    """Like lazy_property, but the value is recomputed in every (forked) process.
+
+    Meant for handles (e.g. HDF5 files) which must not be shared with the
+    child processes: a child inheriting the handle through fork() opens its own
+    one on the first access.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+        self.key = f'_{function.__name__}_by_process'
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        pid = getpid()
+        cached = instance.__dict__.get(self.key)
+        if cached is None or cached[0] != pid:
+            cached = pid, self.function(instance)
+            instance.__dict__[self.key] = cached
+        return cached[1]
@@ -27,6 +27,55 @@ def split_to_pos_and_neg(values):
     return up_i[:u], down_i[:d]
 
 
+def top_mask(keys: np.ndarray, n: int, candidates: np.ndarray) -> np.ndarray:
+    """Mask of the n largest keys among the candidates, in each of the rows.
+
+    Ties at the boundary are resolved in favour of the first
+    occurrences, as in Series.nlargest(n, keep='first').
+    """
+    if n >= keys.shape[1]:
+        return candidates
+    keys = np.where(candidates, keys, -np.inf)
+    threshold = -np.partition(-keys, n - 1, axis=1)[:, n - 1:n]
+    mask = keys > threshold
+    ties = keys == threshold
+    remaining = n - mask.sum(axis=1)
+    # only the rows with more ties than places left need the ties to be counted
+    crowded = np.flatnonzero(ties.sum(axis=1) > remaining)
+    ties[crowded] &= np.cumsum(ties[crowded], axis=1) <= remaining[crowded, np.newaxis]
+    mask |= ties
+    return mask & candidates
+
+
+def top_positive_mask(values: np.ndarray, n: int) -> np.ndarray:
+    """Mask of the n largest positive values in each of the rows (ties as in Series.nlargest)"""
+    return top_mask(values, n, values > 0)
+
+
+def top_positions(keys: np.ndarray, n: int, candidates: np.ndarray) -> np.ndarray:
+    """Positions of the n largest keys among the candidates, in each of the rows.
+
+    The positions are ordered as the result of Series.nlargest(n, keep='first')
+    (by decreasing key, ties by the position); rows with fewer than n candidates
+    are padded with -1 (the width is trimmed to the longest row).
+    """
+    mask = top_mask(keys, n, candidates)
+    counts = mask.sum(axis=1)
+    rows, columns = np.nonzero(mask)
+    # the place of each of the selected positions in its row
+    slots = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    shape = (keys.shape[0], counts.max(initial=0))
+    positions = np.full(shape, -1, dtype=np.int32)
+    positions[rows, slots] = columns
+    selected = np.full(shape, np.inf)
+    selected[rows, slots] = -keys[rows, columns]
+
+    # stable sort keeps the ties in the order of positions, and the padding at the end
+    order = np.argsort(selected, axis=1, kind='stable')
+    return np.take_along_axis(positions, order, axis=1)
+
+
 def one(x: list):
     assert len(x) == 1
     return x[0]
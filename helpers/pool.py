@@ -0,0 +1,350 @@
+import atexit
+import pickle
+from io import BytesIO
+from collections import deque
+from itertools import count
+from multiprocessing import get_context
+from os import getpid
+from queue import Empty
+from time import time
+from traceback import format_exc
+from types import MethodType
+from weakref import finalize
+
+from tqdm import tqdm
+
+from enhanced_multiprocessing import available_cores
+
+
+STOP = None
+# sent to the workers in place of the payload once all the results of a call were collected
+RELEASE = None
+
+
+class RemoteTraceback(Exception):
+    """Traceback of an exception raised in a worker of the pool"""
+
+
+class ReferencePickler(pickle.Pickler):
+    """Pickles the objects of the registry by their keys"""
+
+    def __init__(self, file, registry):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.registry = registry
+        self.references = set()
+
+    def persistent_id(self, obj):
+        key = id(obj)
+        if key in self.registry and self.registry[key] is obj:
+            self.references.add(key)
+            return key
+        return None
+
+
+class ReferenceUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, registry):
+        super().__init__(file)
+        self.registry = registry
+
+    def persistent_load(self, key):
+        return self.registry[key]
+
+
+class PersistentPool:
+    """A pool of forked workers which are kept alive between the map calls.
+
+    The workers keep their per-process state (opened files, loaded metadata,
+    caches) and the data loaded by the preload functions before the fork,
+    so that subsequent calls do not pay for the start up again.
+
+    The function and the shared arguments of a call are sent to each of the
+    workers once per call. The objects which cannot be pickled (e.g. closures
+    of scoring functions) or which are larger than max_payload are pickled
+    by reference to the registry instead; the workers inherit the registry
+    when forked, thus the pool is restarted if a call refers to an object
+    registered after the workers were started. Objects expected to be used
+    in many calls can be registered up front (register()); bound methods are
+    registered by their instances, which (unlike the methods) persist between calls.
+
+    The results of overlapping calls are collected separately; a call which
+    would restart the pool is refused while the results of another are awaited.
+
+    Compatible with the imap() of enhanced_multiprocessing.Pool.
+    """
+
+    # payloads larger than that are rather inherited by the workers than sent to each of them
+    max_payload = 8 * 2**20
+    # workers which did not receive a task for that long release the arguments of the finished calls
+    idle_timeout = 1
+    # the workers are considered stuck (and the pool is stopped) if no result arrives for that long; None to wait forever
+    task_timeout = None
+
+    def __init__(self, processes=None, progress_bar=True, preload=(), task_timeout=None):
+        if not processes:
+            processes = max(available_cores() - 1, 1)
+        self.processes = processes
+        self.progress_bar = progress_bar
+        if task_timeout is not None:
+            self.task_timeout = task_timeout
+        self.preload = list(preload)
+        self.registry = {}
+        self.pinned = set()
+        self.forked = set()
+        self.workers = []
+        self.calls = count()
+        # the results of the calls being collected, received while collecting another call
+        self.pending = {}
+        self.pid = getpid()
+        self.context = get_context('fork')
+
+    @property
+    def is_running(self):
+        return bool(self.workers)
+
+    def register(self, *objects):
+        """Keep the objects in the registry (until shutdown), so that these are inherited by the workers"""
+        for obj in objects:
+            self.registry[id(obj)] = obj
+            self.pinned.add(id(obj))
+
+    def start(self):
+        for preload in self.preload:
+            preload()
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.controls = [self.context.Queue() for _ in range(self.processes)]
+        self.workers = [
+            self.context.Process(target=self.serve, args=(control,), daemon=True)
+            for control in self.controls
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.forked = set(self.registry)
+
+    def stop(self):
+        if self.workers and self.pid == getpid():
+            for _ in self.workers:
+                self.tasks.put(STOP)
+            for worker in self.workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+            for queue in [self.tasks, self.results, *self.controls]:
+                queue.close()
+        self.workers = []
+        self.forked = set()
+        # the tasks of the calls being collected are gone with the workers
+        self.pending = {}
+
+    def shutdown(self):
+        """Stop the workers and release the registered objects"""
+        self.stop()
+        self.registry = {}
+        self.pinned = set()
+
+    def restart(self, needed):
+        self.stop()
+        self.registry = {key: obj for key, obj in self.registry.items() if key in self.pinned or key in needed}
+        self.start()
+
+    def dumps(self, obj):
+        file = BytesIO()
+        pickler = ReferencePickler(file, self.registry)
+        pickler.dump(obj)
+        return file.getvalue(), pickler.references
+
+    def loads(self, data):
+        return ReferenceUnpickler(BytesIO(data), self.registry).load()
+
+    def pickle_call(self, func, shared_args):
+        """Pickle the function and the shared arguments, registering those which should go by reference"""
+        for part in [func, *shared_args]:
+            try:
+                data, _ = self.dumps(part)
+                by_reference = len(data) > self.max_payload
+            except Exception:
+                by_reference = True
+            if by_reference:
+                if isinstance(part, MethodType):
+                    # a new method object is created on each access, its instance is the same
+                    part = part.__self__
+                self.registry[id(part)] = part
+        return self.dumps((func, tuple(shared_args)))
+
+    def receive(self, control, payloads, block=True):
+        """Apply the messages from the control queue to the payloads (each kept until released).
+
+        Returns the id of the last call mentioned, or None if there was no message."""
+        received_call = None
+        while True:
+            try:
+                received_call, payload = control.get(block=block)
+            except Empty:
+                return received_call
+            if payload is RELEASE:
+                payloads.pop(received_call, None)
+            else:
+                # the calls may overlap (e.g. a call started while iterating over the items of another)
+                payloads[received_call] = self.loads(payload)
+            if block:
+                return received_call
+
+    def serve(self, control):
+        payloads = {}
+        # the id of the latest call of which the worker was told
+        latest = -1
+        while True:
+            try:
+                message = self.tasks.get(timeout=self.idle_timeout)
+            except Empty:
+                # e.g. detach from the shared memory of the finished calls
+                received_call = self.receive(control, payloads, block=False)
+                if received_call is not None:
+                    latest = max(latest, received_call)
+                continue
+            if message is STOP:
+                return
+            call, item = message
+            while call not in payloads and call > latest:
+                latest = max(latest, self.receive(control, payloads))
+            if call not in payloads:
+                # left over from an interrupted call, already released
+                continue
+            func, shared_args = payloads[call]
+            try:
+                result = pickle.dumps((True, func(item, *shared_args)), protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                try:
+                    result = pickle.dumps((False, (e, format_exc())))
+                except Exception:
+                    result = pickle.dumps((False, (RuntimeError(repr(e)), format_exc())))
+            self.results.put((call, result))
+
+    def release(self, call):
+        if self.is_running and self.pid == getpid():
+            for control in self.controls:
+                control.put((call, RELEASE))
+
+    def finish(self, call):
+        """Stop collecting the results of the call; the workers can let go of its payload (e.g. detach from the shared memory)"""
+        if self.pending.pop(call, None) is not None:
+            self.release(call)
+
+    def collect(self, call, total, progress):
+        with tqdm(total=total, disable=not progress) as progress_bar:
+            collected = 0
+            last_result = time()
+            try:
+                while collected < total:
+                    if call not in self.pending:
+                        raise RuntimeError('The pool was stopped before all the results of the call were collected')
+                    if self.pending[call]:
+                        result = self.pending[call].popleft()
+                    else:
+                        try:
+                            result_call, result = self.results.get(timeout=self.idle_timeout)
+                        except Empty:
+                            if not all(worker.is_alive() for worker in self.workers):
+                                self.stop()
+                                raise RuntimeError('A worker of the pool has died')
+                            if self.task_timeout is not None and time() - last_result > self.task_timeout:
+                                self.stop()
+                                raise RuntimeError(f'No result from the workers of the pool for {self.task_timeout} seconds')
+                            continue
+                        last_result = time()
+                        if result_call != call:
+                            if result_call in self.pending:
+                                # of another call, collected concurrently
+                                self.pending[result_call].append(result)
+                            # otherwise left over from an interrupted call
+                            continue
+                    success, value = pickle.loads(result)
+                    if not success:
+                        exception, traceback = value
+                        raise exception from RemoteTraceback(traceback)
+                    collected += 1
+                    progress_bar.update(1)
+                    yield value
+            finally:
+                self.finish(call)
+
+    def imap(self, func, iterable, shared_args=tuple(), total=None, progress=None):
+        """Apply function to items of the iterable (followed by the shared args) and yield the results.
+
+        The order of the results is not guaranteed to be preserved.
+        """
+        if progress is None:
+            progress = self.progress_bar
+
+        if self.processes == 1:
+            # for profiling and debugging a single process works better
+            return map(lambda i: func(i, *shared_args), tqdm(iterable, total=total, disable=not progress))
+
+        if self.pid != getpid():
+            raise RuntimeError('The pool can only be used by the process which created it')
+
+        payload, references = self.pickle_call(func, shared_args)
+        if not self.is_running or not references <= self.forked:
+            if self.pending:
+                raise RuntimeError(
+                    'The pool would have to be restarted for this call, but the results of another call'
+                    ' are still being collected; register the objects of this call up front instead'
+                )
+            self.restart(references)
+
+        call = next(self.calls)
+        self.pending[call] = deque()
+        for control in self.controls:
+            control.put((call, payload))
+
+        items = 0
+        for item in iterable:
+            self.tasks.put((call, item))
+            items += 1
+
+        results = self.collect(call, items, progress)
+        # also if the results are never iterated over
+        finalize(results, self.finish, call)
+        return results
+
+
+_shared_pool = None
+
+
+def shared_pool(processes=None, preload=()) -> PersistentPool:
+    """The pool of the current process, created (or re-created for another number of processes) if needed.
+
+    Workers are started on the first use and kept until shutdown_pool().
+
+    Args:
+        preload: functions loading the data to be inherited by the workers (run before each start)
+    """
+    global _shared_pool
+    if not processes:
+        processes = max(available_cores() - 1, 1)
+    if processes == 1:
+        # serial map, no need to replace the pool (if any)
+        return PersistentPool(processes)
+    pool = _shared_pool
+    if pool is None or pool.pid != getpid() or pool.processes != processes:
+        if pool is not None:
+            pool.shutdown()
+        pool = _shared_pool = PersistentPool(processes)
+    new_preloads = [function for function in preload if function not in pool.preload]
+    if new_preloads:
+        pool.preload.extend(new_preloads)
+        # the workers will be started again, with the data loaded
+        pool.stop()
+    return pool
+
+
+def shutdown_pool():
+    """Stop the workers of the shared pool (these are also stopped on exit)"""
+    global _shared_pool
+    if _shared_pool is not None:
+        _shared_pool.shutdown()
+        _shared_pool = None
+
+
+atexit.register(shutdown_pool)
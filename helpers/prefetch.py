@@ -0,0 +1,66 @@
+from queue import Queue, Full
+from threading import Thread, Event
+
+
+class Prefetcher:
+    """Iterate over `iterable` consuming it on a background thread.
+
+    Up to `depth` items are produced ahead of the consumer and held in a bounded
+    queue, so that waiting on the disk overlaps with the processing
+    of the already fetched items.
+
+    Exceptions raised by the producer are re-raised in the consumer thread.
+    """
+
+    _done = object()
+
+    def __init__(self, iterable, depth=2):
+        self.iterable = iterable
+        self.queue = Queue(maxsize=depth)
+        self.stopped = Event()
+        self.thread = Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        # re-check periodically so that the producer does not block forever after close()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for item in self.iterable:
+                if not self._put((item, None)):
+                    return
+        except BaseException as error:
+            self._put((None, error))
+        else:
+            self._put((self._done, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stopped.is_set():
+            raise StopIteration
+        item, error = self.queue.get()
+        if error is not None:
+            self.close()
+            raise error
+        if item is self._done:
+            self.close()
+            raise StopIteration
+        return item
+
+    def close(self):
+        self.stopped.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
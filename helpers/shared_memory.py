@@ -0,0 +1,50 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+def attach(name) -> SharedMemory:
+    """Attach to an existing block of shared memory, leaving its lifetime to the owner"""
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 the block is registered (again) with the resource tracker
+        # which is shared with the owner (a parent process), so it is removed only once
+        return SharedMemory(name=name)
+
+
+class SharedArray:
+    """NumPy array placed in shared memory.
+
+    Pickled by the name of the memory block, so that the worker
+    processes attach to the very same memory (no copies are made);
+    the process which created the array removes the block on close().
+    """
+
+    def __init__(self, array: np.ndarray = None, name=None, shape=None, dtype=None):
+        if array is not None:
+            self.memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.owner = True
+            shape, dtype = array.shape, array.dtype
+        else:
+            self.memory = attach(name)
+            self.owner = False
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf)
+        if array is not None:
+            self.array[...] = array
+
+    def __reduce__(self):
+        return SharedArray, (None, self.memory.name, self.array.shape, self.array.dtype.str)
+
+    def close(self):
+        # the views of the buffer have to be released before closing
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
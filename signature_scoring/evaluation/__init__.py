@@ -236,7 +236,7 @@ def select_cells(signatures_map: Dict[str, SignaturesGrouping], completeness_rat
         for grouping in signatures_map.values()
         for signature in grouping.signature_ids
     }
-    all_data = dcm.sig_info[dcm.sig_info.sig_id.isin(all_signatures)]
+    all_data = dcm.metadata_for_signatures(all_signatures)
     count_by_cell = all_data.drop_duplicates(['cell_id', 'pert_iname']).groupby('cell_id').count().pert_iname
 
     all_substances_and_controls_cnt = len(set(all_data.pert_iname))
@@ -346,7 +346,7 @@ def evaluate(
             f'Keeping {len(selected_cells)} distinct cell lines: {selected_cells}'
         )
         for name, signatures in signatures_map.items():
-            signatures_data = dcm.sig_info[dcm.sig_info.sig_id.isin(signatures.signature_ids)]
+            signatures_data = dcm.metadata_for_signatures(signatures.signature_ids)
             signatures_to_keep = set(signatures_data[signatures_data.cell_id.isin(selected_cells)].sig_id)
             signatures_map[name] = signatures.drop_signatures(
                 [column for column in signatures.signature_ids if column not in signatures_to_keep]
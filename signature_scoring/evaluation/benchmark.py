@@ -3,6 +3,8 @@ from time import time
 
 from pandas import DataFrame
 from tqdm import tqdm_notebook
+
+from helpers.pool import shared_pool
 from ..models.with_controls import ExpressionWithControls
 from . import evaluate
 
@@ -14,6 +16,9 @@ def benchmark(
 ):
     data = []
     is_first_run = True
+    funcs = list(funcs)
+    # the scoring functions are inherited by the workers of the pool, rather than restarting it for each of them
+    shared_pool(kwargs.get('processes')).register(*funcs)
     if progress:
         funcs = tqdm_notebook(funcs)
     for func in funcs:
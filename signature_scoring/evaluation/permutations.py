@@ -10,7 +10,7 @@ from pandas import DataFrame, concat, Series
 from tqdm.auto import tqdm
 
 
-from enhanced_multiprocessing import Pool
+from helpers.pool import shared_pool
 
 from .display import choose_columns, maximized_metrics, minimized_metrics
 from .reevaluation import reevaluate_benchmark
@@ -41,7 +41,7 @@ def generate(
 
     #permutations = list(map(randomizer, range(n), args))
 
-    pool = Pool(processes)
+    pool = shared_pool(processes)
     permutations = list(
         pool.imap(randomizer, range(n), args)
     )
@@ -77,7 +77,7 @@ def reevaluate(permutations: DataFrame, processes=None, **kwargs):
     ensure_kwargs(kwargs)
 
     # reevaluate rows separately, as Func values are not-unique (by permutation definition)
-    reevaluated_permutations = Pool(processes).imap(
+    reevaluated_permutations = shared_pool(processes).imap(
         reevaluate_benchmark,
         [permutations.iloc[[i]] for i in range(len(permutations))],
         shared_args=(
@@ -106,7 +106,7 @@ def reevaluate_with_subtypes(permutations: List[DataFrame], processes=None, **kw
 
     ensure_kwargs(kwargs)
 
-    reevaluated_permutations = Pool(processes).imap(
+    reevaluated_permutations = shared_pool(processes).imap(
         pass_metadata_through(reevaluate_benchmark),
         [
             (result, subtype)
@@ -0,0 +1,57 @@
+from typing import Iterable
+
+from pandas import DataFrame, Series
+
+from data_sources.drug_connectivity_map import SignaturesData
+from .. import score_signatures
+from ..scoring_functions import ScoringFunction
+
+
+def compare_scores(reference: Series, scores: Series) -> dict:
+    # signatures which were scored with the reference precision, but not with the reduced one
+    missing = len(reference.index.difference(scores.index))
+    reference, scores = reference.align(scores, join='inner')
+    difference = (scores - reference).abs()
+    reference_range = reference.max() - reference.min()
+    return {
+        'max_abs_difference': difference.max(),
+        'mean_abs_difference': difference.mean(),
+        # relative to the range of the reference scores
+        'max_relative_difference': difference.max() / reference_range if reference_range else 0,
+        'spearman': reference.corr(scores, method='spearman'),
+        'missing': missing
+    }
+
+
+def compare_precisions(
+    scoring_functions: Iterable[ScoringFunction], disease_signature: Series, signatures: SignaturesData,
+    dtypes=('float32', 'float16'), reference_dtype='float64', **kwargs
+) -> DataFrame:
+    """Measure how much the scores change when the signatures are stored with reduced precision.
+
+    For each scoring function (e.g. connectivity score, XSum, Spearman), the scores computed
+    for signatures cast to each of the dtypes are compared with the scores computed
+    with the reference precision.
+
+    Args:
+        kwargs: passed to score_signatures (e.g. limit, processes)
+    """
+    data = []
+
+    for scoring_function in scoring_functions:
+
+        reference = Series(score_signatures(
+            scoring_function, disease_signature, signatures.astype(reference_dtype), **kwargs
+        ))
+
+        for dtype in dtypes:
+            scores = Series(score_signatures(
+                scoring_function, disease_signature, signatures.astype(dtype), **kwargs
+            ))
+            data.append({
+                'function': scoring_function.__name__,
+                'dtype': dtype,
+                **compare_scores(reference, scores)
+            })
+
+    return DataFrame(data).set_index(['function', 'dtype'])
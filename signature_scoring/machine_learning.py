@@ -29,7 +29,7 @@ class AssociationsPreparation:
     def __init__(self, disease_code_to_disease_terms: Dict[str, List[str]], get_disease_expression: FunctionType):
         self.disease_code_to_disease_terms = disease_code_to_disease_terms
         controls_ids = dcm.all_controls(consensus=True).sig_id
-        self.all_controls = dcm.from_ids(controls_ids, limit_to_one=True).reindex(encoded_census_genes)
+        self.all_controls = dcm.from_ids(controls_ids, limit_to_one=True, genes=encoded_census_genes).reindex(encoded_census_genes)
         self.get_disease_expression = get_disease_expression
 
     @cache_decorator
@@ -72,8 +72,12 @@ class AssociationsPreparation:
         indicated_substances = self.find_substances(disease_name)
         contraindicated_substances = self.find_substances(disease_name, contra=True)
 
-        indications = dcm.from_perturbations(indicated_substances, limit_to_one=True).reindex(encoded_census_genes)
-        contraindications = dcm.from_perturbations(contraindicated_substances, limit_to_one=True).reindex(encoded_census_genes)
+        indications = dcm.from_perturbations(
+            indicated_substances, limit_to_one=True, genes=encoded_census_genes
+        ).reindex(encoded_census_genes)
+        contraindications = dcm.from_perturbations(
+            contraindicated_substances, limit_to_one=True, genes=encoded_census_genes
+        ).reindex(encoded_census_genes)
 
         controls = self.all_controls
 
@@ -2,17 +2,26 @@ import sys
 from abc import ABC, abstractmethod
 from typing import Tuple
 
+import numpy as np
 from pandas import Series, concat, Index
 
 from data_frames import AugmentedSeries, AugmentedDataFrame
-from helpers.cache import hash_series, fast_series_cache_decorator
-from helpers.mathtools import split_to_pos_and_neg
+from helpers.cache import hash_series, bounded_series_cache_decorator
+from helpers.mathtools import split_to_pos_and_neg, top_positions
+
+from .vocabulary import vocabulary
+
+
+# per-process memory budget of the cache of splits (see Signature.split.cache);
+# adjust with Signature.split.cache.resize(max_bytes)
+SPLIT_CACHE_BYTES = 256 * 2 ** 20
 
 
 class Signature(AugmentedSeries):
 
-    # cache may explode memory... but should be of great benefit to benchmarking / permutations
-    @fast_series_cache_decorator
+    # of great benefit to benchmarking / permutations; the least recently used splits are evicted
+    # when the budget is exceeded, see Signature.split.cache.info() for hits, misses and evictions
+    @bounded_series_cache_decorator(SPLIT_CACHE_BYTES)
     def split(self, limit: int, nlargest=Series.nlargest) -> Tuple[Series, Series]:
         # up = self > 0
         # up_regulated = self[up]
@@ -40,37 +49,108 @@ class Signature(AugmentedSeries):
             down_regulated = down_regulated[nlargest(-down_regulated, limit).index].nsmallest(limit)
         return down_regulated, up_regulated
 
+    @classmethod
+    def split_matrix(cls, values: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Split all signatures of a (genes x signatures) matrix at once, as split() with Series.nlargest would.
+
+        The same genes are selected (including the ties at the limit: first come first),
+        but the ties within the selection are ordered by position, which split() does not guarantee.
+
+        Returns:
+            positions (rows of the matrix) of the down- and up-regulated genes,
+            one row per signature, ordered and padded with -1 as by top_positions()
+        """
+        # signatures x genes, so that the genes of each signature are contiguous
+        values = np.ascontiguousarray(values.T)
+        down_regulated = top_positions(-values, limit, values < 0)
+        up_regulated = top_positions(values, limit, values > 0)
+        return down_regulated, up_regulated
+
+    @property
+    def gene_codes(self):
+        """Codes of the genes from the process-wide vocabulary, in the order of the index"""
+        return vocabulary.encode(self.index)
+
     def __hash__(self):
         return hash_series(self)
 
 
 class ScoringData:
+    """Up- and down-regulated genes (and ranks) of a signature, computed on the first access"""
 
-    up: Series
-    down: Series
-    ranks: Series
+    __slots__ = ('signature', 'limit', 'nlargest', '_up', '_down', '_ranks', '_hashable', '_up_codes', '_down_codes')
 
     def __init__(self, signature: Signature, limit=None, nlargest=Series.nlargest):
+        self.signature = signature
+        self.limit = limit
+        self.nlargest = nlargest
+        self._up = None
+        self._down = None
+        self._ranks = None
+        self._hashable = None
+        self._up_codes = None
+        self._down_codes = None
+
+    def _split(self):
+        self._down, self._up = self.signature.split(self.limit or sys.maxsize, nlargest=self.nlargest)
 
-        self.down, self.up = signature.split(limit or sys.maxsize, nlargest=nlargest)
-        if limit:
-            self.ranks = concat([self.up, self.down]).rank(ascending=False)
-        else:
-            self.ranks = signature.rank(ascending=False)
+    @property
+    def up(self) -> Series:
+        if self._up is None:
+            self._split()
+        return self._up
+
+    @property
+    def down(self) -> Series:
+        if self._down is None:
+            self._split()
+        return self._down
 
-        self._hashable = (hash_series(self.up), hash_series(self.down))
+    @property
+    def ranks(self) -> Series:
+        if self._ranks is None:
+            if self.limit:
+                self._ranks = concat([self.up, self.down]).rank(ascending=False)
+            else:
+                # no need to split the signature
+                self._ranks = self.signature.rank(ascending=False)
+        return self._ranks
 
     @property
     def genes(self) -> set:
         return {*self.down.index, *self.up.index}
 
+    @property
+    def up_codes(self) -> np.ndarray:
+        """Codes of the up-regulated genes (in the order of up)"""
+        if self._up_codes is None:
+            # the index of the selection is specific to this signature, not worth caching in the vocabulary
+            self._up_codes = vocabulary.encode(self.up.index, cache=False)
+        return self._up_codes
+
+    @property
+    def down_codes(self) -> np.ndarray:
+        """Codes of the down-regulated genes (in the order of down)"""
+        if self._down_codes is None:
+            self._down_codes = vocabulary.encode(self.down.index, cache=False)
+        return self._down_codes
+
+    @property
+    def gene_codes(self) -> np.ndarray:
+        """Sorted codes of the up- and down-regulated genes"""
+        return np.union1d(self.down_codes, self.up_codes)
+
     @property
     def hashable(self):
+        if self._hashable is None:
+            self._hashable = (hash_series(self.up), hash_series(self.down))
         return self._hashable
 
 
 class ScoringInput(ABC):
 
+    __slots__ = ()
+
     @property
     @abstractmethod
     def hashable(self):
@@ -78,19 +158,60 @@ class ScoringInput(ABC):
 
 
 class Profile(ScoringInput):
+    """Top (limited to the `limit` most changed genes) and full scoring data of a signature.
 
-    top: ScoringData
-    full: ScoringData
+    Both parts are created on demand; if `parts` are given, only these can be accessed
+    (as declared by the scoring function with ScoringFunction.profile_parts).
+    """
 
-    def __init__(self, signature: Signature, limit=None, **kwargs):
+    __slots__ = ('signature', 'limit', 'kwargs', 'parts', '_top', '_full')
+
+    def __init__(self, signature: Signature, limit=None, parts=('top', 'full'), **kwargs):
         if not isinstance(signature, Signature):
             signature = Signature(signature)
-        self.top = ScoringData(signature, limit, **kwargs)
-        self.full = ScoringData(signature, **kwargs)
+        self.signature = signature
+        self.limit = limit
+        self.kwargs = kwargs
+        self.parts = parts
+        self._top = None
+        self._full = None
+
+    def _check_part(self, part):
+        if part not in self.parts:
+            raise AttributeError(f'{part} was not declared as a required part of the profile (parts: {self.parts})')
+
+    @property
+    def top(self) -> ScoringData:
+        if self._top is None:
+            self._check_part('top')
+            # without the limit both parts are the same
+            if self._full is not None and not self.limit:
+                self._top = self._full
+            else:
+                self._top = ScoringData(self.signature, self.limit, **self.kwargs)
+        return self._top
+
+    @property
+    def full(self) -> ScoringData:
+        if self._full is None:
+            self._check_part('full')
+            if self._top is not None and not self.limit:
+                self._full = self._top
+            else:
+                self._full = ScoringData(self.signature, **self.kwargs)
+        return self._full
+
+    def materialize(self, parts=None):
+        """Compute the parts now (e.g. before the profile is shared with forked workers)"""
+        for part in parts or self.parts:
+            scoring_data = getattr(self, part)
+            scoring_data.up, scoring_data.ranks, scoring_data.hashable
+            scoring_data.up_codes, scoring_data.down_codes
+        return self
 
     @property
     def hashable(self):
-        return self.top.hashable, self.full.hashable
+        return tuple(getattr(self, part).hashable for part in self.parts)
 
 
 class SignaturesGrouping(ABC):
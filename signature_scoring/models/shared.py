@@ -0,0 +1,67 @@
+import numpy as np
+from pandas import Index, Series
+
+from helpers.shared_memory import SharedArray
+
+from . import SignaturesGrouping, SignaturesCollection
+
+
+class SharedSignaturesCollection(SignaturesGrouping):
+    """SignaturesCollection with the profiles (and the identifiers) in shared memory.
+
+    Meant to be passed to the pool workers: it is pickled by the names of the
+    shared memory blocks and the workers access the profiles without copying.
+    The profiles are stored one per row, so that each of them is contiguous.
+    """
+
+    def __init__(self, values: SharedArray, genes: SharedArray, ids: SharedArray):
+        self.shared = [values, genes, ids]
+        self.values = values.array
+        self._genes = Index(genes.array.tolist())
+        self.ids = ids.array.tolist()
+        self.positions = {signature_id: i for i, signature_id in enumerate(self.ids)}
+
+    @classmethod
+    def from_collection(cls, collection: SignaturesCollection):
+        return cls(
+            SharedArray(np.ascontiguousarray(collection.values.T)),
+            SharedArray(np.asarray(collection.index.tolist())),
+            SharedArray(np.asarray(collection.columns.tolist()))
+        )
+
+    def __reduce__(self):
+        return SharedSignaturesCollection, tuple(self.shared)
+
+    def __getitem__(self, signature_id) -> Series:
+        return Series(self.values[self.positions[signature_id]], index=self._genes, name=signature_id)
+
+    def groups_keys(self):
+        # a view of the keys: membership checks do not require a scan
+        return self.positions.keys()
+
+    @property
+    def signature_ids(self):
+        return set(self.ids)
+
+    @property
+    def genes(self):
+        return self._genes
+
+    def drop_signatures(self, ids):
+        ids = set(ids)
+        kept = [i for i, signature_id in enumerate(self.ids) if signature_id not in ids]
+        return SignaturesCollection(
+            self.values[kept].T, index=self._genes,
+            columns=[self.ids[i] for i in kept]
+        )
+
+    def close(self):
+        self.values = None
+        for shared in self.shared:
+            shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Iterable
+from weakref import ref
+
+import numpy as np
+from pandas import Index
+
+
+class GeneVocabulary:
+    """Process-wide mapping of gene identifiers to int32 codes.
+
+    Identifiers are normalised to bytes (as used by CMap), so that
+    str and int Entrez ids from the queries get the same codes as
+    the genes of the signatures. Intersections and lookups on the codes
+    are integer operations, without hashing of the byte strings.
+
+    The codes are assigned under a lock, so that the vocabulary can be
+    shared by the threads scoring the signatures.
+    """
+
+    def __init__(self, cached_indices=16):
+        self.codes = {}
+        self.genes = []
+        # the known genes in the order of their codes, for the vectorized lookups (rebuilt when genes are added)
+        self._index = None
+        self.lock = RLock()
+        # pandas indices are immutable: encoded indices are remembered (by identity, while alive)
+        self.index_cache = OrderedDict()
+        self.cached_indices = cached_indices
+
+    @staticmethod
+    def normalize(gene):
+        return gene if type(gene) is bytes else str(gene).encode()
+
+    def code(self, gene) -> int:
+        gene = self.normalize(gene)
+        code = self.codes.get(gene)
+        if code is None:
+            with self.lock:
+                # the gene might have been added by another thread in the meantime
+                code = self.codes.get(gene)
+                if code is None:
+                    code = len(self.genes)
+                    self.genes.append(gene)
+                    self.codes[gene] = code
+                    self._index = None
+        return code
+
+    @property
+    def index(self) -> Index:
+        """Index of the known genes, the position of each gene being its code"""
+        with self.lock:
+            if self._index is None:
+                self._index = Index(self.genes, dtype=object)
+            return self._index
+
+    def _cached(self, genes: Index):
+        with self.lock:
+            cached = self.index_cache.get(id(genes))
+            if cached is not None and cached[0]() is genes:
+                self.index_cache.move_to_end(id(genes))
+                return cached[1]
+
+    def _remember(self, genes: Index, codes: np.ndarray):
+        key = id(genes)
+
+        def forget(reference):
+            # the id might be reused by another index once this one is gone
+            with self.lock:
+                if key in self.index_cache and self.index_cache[key][0] is reference:
+                    del self.index_cache[key]
+
+        with self.lock:
+            self.index_cache[key] = (ref(genes, forget), codes)
+            if len(self.index_cache) > self.cached_indices:
+                self.index_cache.popitem(last=False)
+
+    def encode(self, genes: Iterable, cache=True) -> np.ndarray:
+        """Codes of the genes (in the same order), adding the unknown genes to the vocabulary.
+
+        Args:
+            cache: remember the codes of a pandas index (e.g. of a collection of signatures),
+                rather than look them up again when the same index is encoded next time
+        """
+        is_index = isinstance(genes, Index)
+        if is_index and cache:
+            cached = self._cached(genes)
+            if cached is not None:
+                return cached
+
+        identifiers = genes if is_index else Index(list(genes), dtype=object)
+        if identifiers.inferred_type != 'bytes':
+            identifiers = Index([self.normalize(gene) for gene in identifiers], dtype=object)
+
+        # a single lookup in the hash table of the vocabulary index for all the genes
+        codes = self.index.get_indexer(identifiers)
+        unknown = codes == -1
+        if unknown.any():
+            codes[unknown] = [self.code(gene) for gene in identifiers[unknown]]
+        codes = codes.astype(np.int32)
+
+        if is_index and cache:
+            # shared by the callers
+            codes.flags.writeable = False
+            self._remember(genes, codes)
+        return codes
+
+    def encode_set(self, genes: Iterable) -> np.ndarray:
+        """Sorted, unique codes of the genes"""
+        return np.unique(self.encode(genes))
+
+    def decode(self, codes: np.ndarray) -> list:
+        """Identifiers (as bytes) of the genes with given codes"""
+        return [self.genes[code] for code in codes]
+
+    def isin(self, genes: Iterable, codes: np.ndarray) -> np.ndarray:
+        """Boolean mask of the genes which are among given codes"""
+        return np.isin(self.encode(genes), codes)
+
+
+vocabulary = GeneVocabulary()
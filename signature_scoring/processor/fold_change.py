@@ -4,6 +4,7 @@ import numpy as np
 from pandas import Series
 
 from data_sources.drug_connectivity_map import get_controls_for_signatures
+from helpers.mathtools import top_positions
 
 from ..models import Signature
 from .processor import SignatureProcessor
@@ -17,10 +18,25 @@ class FoldChangeSignature(Signature):
         down_regulated = down_regulated[nlargest(-down_regulated.abs(), limit).index]
         return down_regulated, up_regulated
 
+    @classmethod
+    def split_matrix(cls, values: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.ascontiguousarray(values.T)
+        magnitude = np.abs(values)
+        down_regulated = top_positions(-magnitude, limit, values < -1)
+        up_regulated = top_positions(magnitude, limit, values > -1)
+        return down_regulated, up_regulated
+
 
 class FoldChangeSignatureProcessor(SignatureProcessor):
 
-    signature = FoldChangeSignature
+    # the disease and the compound profiles (and the batch engines) select the genes by the fold-change rule
+    signature_type = FoldChangeSignature
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # the workers need all the ids to get the (cached) controls of the whole collection
+        state['ids'] = self.ids
+        return state
 
     def calculate_fold_change(self, signature, selected_genes, preserve_sign=False):
 
@@ -41,6 +57,16 @@ class FoldChangeSignatureProcessor(SignatureProcessor):
 
         return signature_fc
 
+    def prepare_batch(self, signatures):
+        if signatures.values.dtype == np.float16:
+            signatures = signatures.astype(np.float32)
+        controls = self.controls(signatures.index).reindex(index=signatures.index, columns=signatures.columns)
+        return signatures / controls.values
+
+    def precomputed_ranks(self, signatures):
+        # the ranks of fold changes differ from the ranks of the profiles
+        return None
+
     def transform_signature(self, signature, selected_genes):
         return self.calculate_fold_change(signature, selected_genes)
 
@@ -1,15 +1,21 @@
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from time import time
 
+from numpy import array, float16, float32, intersect1d, isnan, ndarray
 from pandas import Series
 from tqdm import tqdm
 
 from data_sources.drug_connectivity_map import Scores, dcm
-from helpers import first, WarningManager
+from helpers import WarningManager
+from helpers.pool import shared_pool
 
-from enhanced_multiprocessing import Pool
+from enhanced_multiprocessing import available_cores
 from enhanced_multiprocessing.cache_manager import multiprocess_cache_manager
 
-from ..models import Signature, Profile, SignaturesGrouping
+from ..models import Signature, Profile, SignaturesGrouping, SignaturesCollection, vocabulary
+from ..models.shared import SharedSignaturesCollection
 from ..scoring_functions import ScoringFunction
 
 
@@ -17,14 +23,13 @@ CACHE = None
 multiprocess_cache_manager.add_cache(globals(), 'CACHE', 'dict')
 
 
-def select_genes(common_genes, gene_subset):
+def select_genes(common_genes: ndarray, gene_subset):
+    """Limit the (sorted) codes of the common genes to the genes of the subset, if given"""
     if not gene_subset:
         return common_genes
 
-    if type(first(common_genes)) is bytes and type(first(gene_subset)) is not bytes:
-        gene_subset = {str(gene).encode() for gene in gene_subset}
-
-    return common_genes & set(gene_subset)
+    # the vocabulary normalises str and int ids to bytes, as used by CMap
+    return intersect1d(common_genes, vocabulary.encode_set(gene_subset), assume_unique=True)
 
 
 class SignatureProcessor:
@@ -35,6 +40,12 @@ class SignatureProcessor:
     signature_type = Signature
     scores_type = Scores
 
+    # signatures are sent to the pool workers in chunks which take about task_duration seconds to score,
+    # as estimated from the time of scoring of the first pilot_size signatures
+    pilot_size = 4
+    task_duration = 0.05
+    chunks_per_process = 4
+
     def __init__(self, signatures: SignaturesGrouping, warning_manager=None, progress=False, processes=None):
 
         if signatures is None:
@@ -50,31 +61,88 @@ class SignatureProcessor:
         self.processes = processes
         self.warning_manager = warning_manager or WarningManager()
         self.scale = False
-
-    def get_signature_group(self, group_id):
-        if group_id in self.signature_groups.groups_keys():
-            signature = self.signature_groups[group_id]
+        self.prefetched = None
+
+    def __getstate__(self):
+        # the workers are only sent the processor to score the chunks of ids they get:
+        # these need neither all the ids, nor the prefetching (which cannot be pickled),
+        # and the collection comes with the shared arguments (e.g. in shared memory)
+        state = self.__dict__.copy()
+        state['ids'] = None
+        state['prefetched'] = None
+        state['signature_groups'] = None
+        return state
+
+    def get_signature_group(self, group_id, signatures: SignaturesGrouping):
+        if group_id in signatures.groups_keys():
+            signature = signatures[group_id]
         else:
             if group_id in CACHE:
                 signature = CACHE[group_id]
             else:
-                signature = dcm.from_id(group_id)
+                signature = self.take_prefetched(group_id)
+                if signature is None:
+                    signature = dcm.from_id(group_id)
                 CACHE[group_id] = signature
+            # align with the genes of the collection (which might be already limited to the selected genes)
+            signature = signature.reindex(signatures.genes)
         return signature
 
+    def prefetch_signatures(self, ids, signatures: SignaturesGrouping):
+        """Start reading the signatures which are not in the collection on a background thread"""
+        keys = set(signatures.groups_keys())
+        missing = [group_id for group_id in ids if group_id not in keys]
+        if missing:
+            self.prefetched = dcm.iterate_signatures(missing, genes=signatures.genes)
+
+    def take_prefetched(self, group_id):
+        # signatures are consumed in the order of prefetching; those found in the cache are skipped
+        for signature in self.prefetched or []:
+            signature = signature.iloc[:, 0]
+            if signature.name == group_id:
+                return signature
+
+    def stop_prefetching(self):
+        if self.prefetched is not None:
+            self.prefetched.close()
+            self.prefetched = None
+
+    def can_score_in_batch(self, signatures: SignaturesCollection):
+        # the batch engines score the whole collection at once and do not handle missing values
+        return list(signatures.columns) == list(self.ids) and not isnan(signatures.values).any()
+
+    def prepare_batch(self, signatures):
+        """Apply the per-signature transformations to the whole collection"""
+        if signatures.values.dtype == float16:
+            signatures = signatures.astype(float32)
+        if self.scale:
+            signatures = signatures / (signatures.max() - signatures.min())
+        return signatures
+
+    def precomputed_ranks(self, signatures):
+        """Ranks of the profiles over the genes of the collection, if precomputed with dcm.create_rank_store()
+
+        (scaling does not change the ranks, other transformations would; the profiles
+        cast to another type than the type of the precomputed ranks are ranked again)"""
+        return dcm.rank_store_for(signatures.index, signatures.columns, signatures.values.dtype)
+
     def score_signature_group(
-        self, signature_id, disease_profile, rows_of_selected_genes, limit,
+        self, signature_id, signatures: SignaturesGrouping, disease_profile, rows_of_selected_genes, limit,
         scoring_func: ScoringFunction, gene_selection,
         warn_about_cache=True
     ):
-        signature = self.get_signature_group(signature_id)
+        signature = self.get_signature_group(signature_id, signatures)
         signature = signature[rows_of_selected_genes]
+        if signature.values.dtype == float16:
+            # half precision is only meant for storage, the scores are computed in (at least) single precision
+            signature = signature.astype(float32)
         signature = self.transform_signature(signature, signature.index)
 
         if scoring_func.input == Profile:
             compound_profile = Profile(
                 self.signature_type(signature),
-                limit, nlargest=gene_selection
+                limit, nlargest=gene_selection,
+                parts=scoring_func.profile_parts
             )
         else:
             compound_profile = signature
@@ -86,18 +154,52 @@ class SignatureProcessor:
         if scoring_func.custom_multiprocessing:
             args['cores'] = self.processes
 
-        if scoring_func.supports_cache:
+        if scoring_func.supports_cache and scoring_func.prepare is None:
             args['warn_about_cache'] = warn_about_cache
 
-        score = scoring_func(disease_profile, compound_profile, **args)
+        # the disease was already prepared (see ScoringFunction.prepare_disease)
+        score = scoring_func.func(disease_profile, compound_profile, **args)
 
         del signature, compound_profile
 
         return signature_id, score
 
+    def score_signature_chunk(self, chunk, *shared_args):
+        """Score a chunk of signatures, returning the ids and the scores of those which were scored"""
+        scored = [self.score_signature_group(signature_id, *shared_args) for signature_id in chunk]
+        scored = [(signature_id, score) for signature_id, score in scored if score is not None]
+        return [signature_id for signature_id, score in scored], array([score for signature_id, score in scored])
+
+    def chunks(self, ids, latency=None):
+        """Split the ids into chunks which take about task_duration to score (given the latency of one signature),
+
+        but still give each of the processes a few chunks to balance the load.
+        """
+        if not ids:
+            return []
+        # as in Pool, one core is left for the main process by default
+        processes = self.processes or max(available_cores() - 1, 1)
+        most = max(len(ids) // (processes * self.chunks_per_process), 1)
+        size = 1 if not latency else min(max(int(self.task_duration / latency), 1), most)
+        return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+    @contextmanager
+    def sharing_signatures(self, collection: SignaturesGrouping):
+        """Place the profiles of the collection in shared memory while mapping over the pool workers,
+
+        so that the workers attach to the same memory rather than receive (or copy) the collection.
+        Yields the collection to be passed to the workers.
+        """
+        if self.processes == 1 or not isinstance(collection, SignaturesCollection):
+            yield collection
+            return
+        with SharedSignaturesCollection.from_collection(collection) as shared:
+            yield shared
+
     @property
     def pool(self):
-        return Pool(self.processes, progress_bar=self.progress)
+        # the workers are kept between the calls (and shared by the processors)
+        return shared_pool(self.processes)
 
     def transform_signature(self, signature, selected_genes):
         if self.scale:
@@ -106,7 +208,11 @@ class SignatureProcessor:
 
     def select_common_genes(self, disease_signature, gene_subset=None):
 
-        common_genes = set(self.signature_groups.genes) & set(disease_signature.index)
+        common_genes = intersect1d(
+            vocabulary.encode_set(self.signature_groups.genes),
+            vocabulary.encode_set(disease_signature.index),
+            assume_unique=True
+        )
         common_genes = select_genes(common_genes, gene_subset)
 
         n = len(common_genes)
@@ -123,9 +229,23 @@ class SignatureProcessor:
             self.warning_manager.warn_once(f'Selected only {len(selected_genes)} genes out of {2 * limit} allowed.')
 
     def single_process_map_with_shared(self, func, iterable, shared_args):
+        # the prefetching thread is not carried over to forked processes, thus only used here
+        # (the collection is the first of the shared arguments)
+        self.prefetch_signatures(iterable, shared_args[0])
         if self.progress:
             iterable = tqdm(iterable)
-        return [func(i, *shared_args) for i in iterable]
+        try:
+            return [func(i, *shared_args) for i in iterable]
+        finally:
+            self.stop_prefetching()
+
+    def thread_map(self, func, iterable, shared_args):
+        """Map over a pool of threads of this process: the data are used as they are, without copies"""
+        # all the cores can be used, as the main thread only waits for the results
+        with ThreadPoolExecutor(self.processes or available_cores()) as executor:
+            futures = [executor.submit(func, i, *shared_args) for i in iterable]
+            for future in tqdm(as_completed(futures), total=len(futures), disable=not self.progress):
+                yield future.result()
 
     def score_signatures(
         self, scoring_func, disease_signature, limit=500, gene_subset=None,
@@ -138,51 +258,92 @@ class SignatureProcessor:
         limit = limit or sys.maxsize
 
         common_genes = self.select_common_genes(disease_signature, gene_subset)
-        disease_signature = disease_signature[disease_signature.index.isin(common_genes)]
+        disease_signature = disease_signature[vocabulary.isin(disease_signature.index, common_genes)]
 
         if scoring_func.input == Profile:
             disease_profile = Profile(
                 self.signature_type(disease_signature),
                 limit=limit, nlargest=gene_selection
             )
-            selected_genes = disease_profile.top.genes
+            # computed once, before the profile is shared with the workers
+            disease_profile.materialize(scoring_func.profile_parts)
+            selected_genes = disease_profile.top.gene_codes
         else:
             disease_profile = disease_signature
-            selected_genes = disease_profile.index
+            selected_genes = vocabulary.encode_set(disease_profile.index)
 
         if not limit_genes:
             selected_genes = common_genes
 
         self.warn_if_few_genes_selected(selected_genes, limit)
 
-        rows_of_selected_genes = self.signature_groups.genes.isin(selected_genes)
+        signatures = self.signature_groups
+        rows_of_selected_genes = vocabulary.isin(signatures.genes, selected_genes)
+
+        if isinstance(signatures, SignaturesCollection):
+            # select the genes once for the whole collection, rather than for each of the signatures
+            # (for this query only: the processor keeps all the genes)
+            signatures = signatures[rows_of_selected_genes]
+            rows_of_selected_genes = slice(None)
+
+            if scoring_func.batch and self.can_score_in_batch(signatures):
+                scores = scoring_func.batch(
+                    disease_profile, self.prepare_batch(signatures),
+                    limit=limit, gene_selection=gene_selection,
+                    split=self.signature_type.split_matrix,
+                    rank_store=self.precomputed_ranks(signatures)
+                )
+                if scores is not None:
+                    return self.scores_type(scores)
+
+        # the disease-side artifacts are computed once, before these are shared with the workers
+        prepared_disease = scoring_func.prepare_disease(
+            disease_profile, **({'cores': self.processes} if scoring_func.custom_multiprocessing else {})
+        )
 
-        shared_args = [disease_profile, rows_of_selected_genes, limit, scoring_func, gene_selection]
+        shared_args = [signatures, prepared_disease, rows_of_selected_genes, limit, scoring_func, gene_selection]
 
         start = 0
         scores = []
 
-        if scoring_func.multiprocessing_exclude_first and not force_multiprocess_all:
+        if scoring_func.multiprocessing_exclude_first and scoring_func.prepare is None and not force_multiprocess_all:
             # first signature is scored in one process,
             # so that the common cache is populated
             # without repetition of calculations
             scores = [self.score_signature_group(self.ids[0], *shared_args)]
             start = 1
 
-        map_with_shared = (
-            self.single_process_map_with_shared
-            if scoring_func.custom_multiprocessing else
-            self.pool.imap
-        )
-
-        # and then iteratively apply scoring function to each next compound signature
-        scores.extend(
-            map_with_shared(
-                self.score_signature_group,
-                self.ids[start:],
-                shared_args=shared_args
+        if scoring_func.parallelism == 'serial':
+            # and then iteratively apply scoring function to each next compound signature
+            scores.extend(
+                self.single_process_map_with_shared(
+                    self.score_signature_group,
+                    self.ids[start:],
+                    shared_args=shared_args
+                )
             )
-        )
+        else:
+            latency = None
+            if not force_multiprocess_all:
+                # a few signatures are scored here to measure how long a single one takes
+                pilot = self.ids[start:start + self.pilot_size]
+                began = time()
+                scores.extend(self.score_signature_group(signature_id, *shared_args) for signature_id in pilot)
+                latency = (time() - began) / len(pilot) if pilot else None
+                start += len(pilot)
+
+            chunks = self.chunks(self.ids[start:], latency)
+
+            if scoring_func.parallelism == 'threads':
+                for chunk_ids, chunk_scores in self.thread_map(self.score_signature_chunk, chunks, shared_args):
+                    scores.extend(zip(chunk_ids, chunk_scores))
+            else:
+                with self.sharing_signatures(signatures) as shared_signatures:
+                    for chunk_ids, chunk_scores in self.pool.imap(
+                        self.score_signature_chunk, chunks,
+                        shared_args=[shared_signatures, *shared_args[1:]], progress=self.progress
+                    ):
+                        scores.extend(zip(chunk_ids, chunk_scores))
 
         scores = [
             (signature_id, score)
@@ -1,6 +1,7 @@
 from types import FunctionType
 from typing import Type
 from dataclasses import dataclass
+from functools import partial
 
 from ..models import (
     Profile,
@@ -38,19 +39,55 @@ class ScoringFunction:
     #   was used to validate correctness of the pipeline.
     grouping: str = None
 
+    # the function handles the parallelism on its own (it accepts additional keyword argument: cores)
     custom_multiprocessing: bool = False
 
+    # how the signatures are distributed when scored one by one (i.e. not in batch):
+    #   'processes' - over a pool of worker processes (default),
+    #   'threads' - over a pool of threads of the current process: no data are pickled nor copied,
+    #       but it only pays off if func releases the GIL for most of the time (NumPy, nogil numba kernels),
+    #   'serial' - one by one in the current process (default if custom_multiprocessing)
+    parallelism: str = None
+
+    # whether the first signature should be scored before starting the pool,
+    # so that the caches of the disease results get populated (unused if prepare is given)
     multiprocessing_exclude_first: bool = True
 
     # a hook to run janitorial tasks (garbage collection, display preparation)
     # before start of a larger batch of tasks; completely optional
     before_batch: FunctionType = lambda: None
 
+    # optional computation of the disease-side artifacts (e.g. enrichment of gene sets in the disease):
+    #   prepare(disease, **kwargs) -> prepared
+    # called once per query by the processor (with the same keyword arguments as func), or
+    # on each direct call of the scoring function; func then receives the prepared object in
+    # place of the disease; it is shared with all the workers, thus has to be treated as immutable
+    prepare: FunctionType = None
+
     # if a function supports results caching then
-    # its func should accept additional keyword argument:
+    # its prepare (or func, if there is no prepare step) should accept additional keyword argument:
     #   warn_about_cache: bool
     supports_cache: bool = None
 
+    # parts of the Profile inputs (top and/or full) which are read by func;
+    # the compound profiles are computed lazily and limited to these parts
+    profile_parts: tuple = ('top', 'full')
+
+    # optional vectorized counterpart of func, scoring all signatures of a SignaturesCollection at once
+    # (used instead of the per-signature calls):
+    #   batch(disease: Profile, signatures: DataFrame of genes x signatures, limit, gene_selection, split, rank_store) -> {signature_id: score}
+    # split is the split_matrix() of the signature type used by the processor;
+    # rank_store holds the precomputed ranks of the signatures over these genes, or is None;
+    # batch may return None if the given options are not supported in the batch mode
+    batch: FunctionType = None
+
+    parallelism_modes = {'processes', 'threads', 'serial'}
+
+    def __post_init__(self):
+        if self.parallelism is None:
+            self.parallelism = 'serial' if self.custom_multiprocessing else 'processes'
+        assert self.parallelism in self.parallelism_modes
+
     @property
     def collection(self) -> Type[SignaturesGrouping]:
         """Provides constructor which (when applied to SignaturesData)
@@ -69,11 +106,26 @@ class ScoringFunction:
     def is_applicable_to_control_signatures(self):
         return self.input != ExpressionWithControls
 
+    def prepare_disease(self, disease, warn_about_cache=True, **kwargs):
+        """The first argument for func: the prepared disease, if prepare is given"""
+        if self.prepare is None:
+            return disease
+        if self.supports_cache:
+            kwargs['warn_about_cache'] = warn_about_cache
+        return self.prepare(disease, **kwargs)
+
     def __call__(self, disease: input, compound: input, **kwargs):
+        if self.prepare is not None:
+            # called directly, with the disease yet to be prepared
+            disease = self.prepare_disease(disease, **kwargs)
+            kwargs.pop('warn_about_cache', None)
         return self.func(disease, compound, **kwargs)
 
 
-def scoring_function(func, **kwargs):
+def scoring_function(func=None, **kwargs):
+    if func is None:
+        # used as a decorator with options: @scoring_function(batch=...)
+        return partial(scoring_function, **kwargs)
     proxy = ScoringFunction(func, **kwargs)
     proxy.__name__ = func.__name__
     proxy.original_function = func
@@ -2,13 +2,17 @@ from copy import copy
 from functools import partial
 from typing import Dict
 
+import numpy as np
+from numba import jit
 from numpy import sign, square
-from pandas import Series, concat
+from pandas import DataFrame, Series, concat
 from rpy2.robjects import r
+from scipy.stats import rankdata
 
+from data_sources.rank_store import RankStore
 from helpers.inline import inline, compile_with_inline, inline_if_else
 
-from ..models import Profile
+from ..models import Profile, Signature
 from . import scoring_function
 
 
@@ -37,9 +41,79 @@ def generalized_kolmogorov_smirnov(instance: Series, tag_list: Series, p: float
     return - max(running_sum_statistic_hits - running_sum_statistic_misses, key=abs)
 
 
-def create_generalized_kolmogorov_smirnov(p: float = 1):
-    compute_ks = partial(generalized_kolmogorov_smirnov, p=p)
-    compute_ks.__name__ = f'generalized_kolmogorov_smirnov_{p}'
+@jit(nopython=True, nogil=True)
+def descending_average_ranks(values):
+    """Same as Series.rank(ascending=False) for values sorted in descending order"""
+    n = len(values)
+    ranks = np.empty(n)
+    start = 0
+    while start < n:
+        end = start + 1
+        while end < n and values[end] == values[start]:
+            end += 1
+        sum_ranks = 0.0
+        for i in range(start, end):
+            sum_ranks += i + 1
+        for i in range(start, end):
+            ranks[i] = sum_ranks / (end - start)
+        start = end
+    return ranks
+
+
+@jit(nopython=True, nogil=True)
+def generalized_kolmogorov_smirnov_kernel(n, positions, hit_weights, decrement):
+    """Running sums over the n genes of the instance; positions of the tags have to be sorted"""
+    hits = 0.0
+    misses = 0.0
+    best = 0.0
+    best_abs = -1.0
+    tag = 0
+    for i in range(n):
+        if tag < len(positions) and positions[tag] == i:
+            hits += hit_weights[tag]
+            tag += 1
+        else:
+            misses += decrement
+        difference = hits - misses
+        if abs(difference) > best_abs:
+            best = difference
+            best_abs = abs(difference)
+    return -best
+
+
+def tag_positions(instance: Series, tag_list: Series):
+    """Sorted positions of the tags in the instance; tags absent from the instance are skipped"""
+    positions = instance.index.get_indexer(tag_list.index)
+    return np.unique(positions[positions != -1])
+
+
+def generalized_kolmogorov_smirnov_compiled(instance: Series, tag_list: Series, p: float = 1):
+    """Same as generalized_kolmogorov_smirnov (and with the same results), but without intermediate Series"""
+    values = instance.values
+    n = len(values)
+    t = len(tag_list)
+
+    positions = instance.index.get_indexer(tag_list.index)
+    if (positions == -1).any():
+        raise KeyError('Not all tags are present in the instance')
+
+    ranked_list = descending_average_ranks(values) + 1
+
+    # in the order of the tag list, so that the sum is computed exactly as before
+    hit_denominator = np.power(ranked_list[positions], p).sum()
+
+    positions = np.unique(positions)
+    hit_weights = np.power(ranked_list[positions], p) / hit_denominator
+
+    return generalized_kolmogorov_smirnov_kernel(n, positions, hit_weights, 1 / (n - t))
+
+
+def create_generalized_kolmogorov_smirnov(p: float = 1, compiled=False):
+    compute_ks = partial(
+        generalized_kolmogorov_smirnov_compiled if compiled else generalized_kolmogorov_smirnov,
+        p=p
+    )
+    compute_ks.__name__ = f'generalized_kolmogorov_smirnov_{p}' + ('_compiled' if compiled else '')
     return compute_ks
 
 
@@ -100,27 +174,121 @@ def kolmogorov_smirnov(
         return - max(running_sum_statistic_hits_cum - running_sum_statistic_misses_cum, key=abs)
 
 
-def create_kolmogorov_smirnov(proper_ks=True, visualize=False, check_order=True, denominator='n'):
+@jit(nopython=True, nogil=True)
+def kolmogorov_smirnov_kernel(positions, misses, t, zero_based_j):
+    """KS statistic given the (sorted) positions of the tags in the instance and V(j)/n of each of the tags"""
+    hits = 0.0
+    previous_hits = 0.0
+    a = -np.inf
+    b = -np.inf
+    best = 0.0
+    best_abs = -1.0
+    for j in range(len(positions)):
+        hits += 1 / t
+        difference = hits - misses[j]
+        if difference > a:
+            a = difference
+        if misses[j] - previous_hits > b:
+            b = misses[j] - previous_hits
+        if abs(difference) > best_abs:
+            best = difference
+            best_abs = abs(difference)
+        previous_hits = hits
+    if zero_based_j:
+        return -(a if a > b else -b)
+    return -best
+
+
+def kolmogorov_smirnov_compiled(
+    instance: Series, tag_list: Series,
+    zero_based_j=True, check_order=True, divide_by_n=True
+):
+    """Same as kolmogorov_smirnov (and with the same results), but without intermediate Series"""
+    values = instance.values
+
+    if check_order:
+        assert (values[:-1] >= values[1:]).all()
+
+    n = len(values)
+    t = len(tag_list)
+
+    misses_denominator = n if divide_by_n else n - t
+
+    assert len(tag_list.index)
+
+    positions = tag_positions(instance, tag_list)
+
+    if len(positions) < 1:
+        return 0
+
+    misses = (descending_average_ranks(values)[positions] + 1) / misses_denominator
+
+    return kolmogorov_smirnov_kernel(positions, misses, t, zero_based_j)
+
+
+def create_kolmogorov_smirnov(proper_ks=True, visualize=False, check_order=True, denominator='n', compiled=False):
 
     assert denominator in ['n-t', 'n']
 
-    compute_ks = partial(
-        kolmogorov_smirnov,
-        zero_based_j=proper_ks,
-        visualize=visualize,
-        check_order=check_order,
-        divide_by_n=denominator == 'n'
-    )
+    if compiled:
+        assert not visualize
+        compute_ks = partial(
+            kolmogorov_smirnov_compiled,
+            zero_based_j=proper_ks,
+            check_order=check_order,
+            divide_by_n=denominator == 'n'
+        )
+    else:
+        compute_ks = partial(
+            kolmogorov_smirnov,
+            zero_based_j=proper_ks,
+            visualize=visualize,
+            check_order=check_order,
+            divide_by_n=denominator == 'n'
+        )
 
     compute_ks.__name__ = (
         f'kolmogorov_smirnov'
         f'_{"safe" if check_order else "fast"}'
         f'_{"properKS" if proper_ks else "KSbased"}'
         f'_{denominator.replace("-", "")}'
+        + ('_compiled' if compiled else '')
     )
     return compute_ks
 
 
+def batch_kolmogorov_smirnov(positions, tags, t, misses_denominator, zero_based_j=True):
+    """kolmogorov_smirnov for many signatures at once.
+
+    Args:
+        positions: V(j) of the genes (genes x signatures), with the genes of each
+            signature ordered by increasing V(j) (i.e. as in the sorted instance)
+        tags: boolean mask of the genes in the tag list (genes x signatures)
+        t: length of the tag list, per signature
+        misses_denominator: n or (n - t), per signature
+    """
+    t = np.asarray(t, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # adding zeros does not change the sums: the cumulative sums over the tags
+        # are exactly the same as in the sequential version
+        hits = np.cumsum(np.where(tags, 1 / t, 0), axis=0)
+        misses = positions / misses_denominator
+    found = tags.any(axis=0)
+
+    if zero_based_j:
+        a = np.where(tags, hits - misses, -np.inf).max(axis=0)
+        # 0-based j over t
+        previous_hits = np.vstack([np.zeros((1, hits.shape[1])), hits[:-1]])
+        b = np.where(tags, misses - previous_hits, -np.inf).max(axis=0)
+        ks = np.where(a > b, -a, b)
+    else:
+        difference = np.where(tags, hits - misses, 0)
+        first_max_abs = np.argmax(np.where(tags, np.abs(difference), -1), axis=0)
+        ks = -difference[first_max_abs, np.arange(difference.shape[1])]
+
+    return np.where(found, ks, 0)
+
+
 def kolmogorov_smirnov_plot(running_sum_statistic_misses, running_sum_statistic_hits):
     from seaborn import lineplot
     from matplotlib import pyplot as plt
@@ -182,6 +350,109 @@ def max_up_or_down(ks_up, ks_dn, factor):
     return max(ks_up, ks_dn, key=abs) * factor
 
 
+def kolmogorov_smirnov_options(statistic):
+    """Options of the kolmogorov_smirnov statistic, or None for other statistics"""
+    if statistic in (kolmogorov_smirnov, kolmogorov_smirnov_compiled):
+        options = {}
+    elif (
+        isinstance(statistic, partial) and not statistic.args
+        and statistic.func in (kolmogorov_smirnov, kolmogorov_smirnov_compiled)
+    ):
+        options = statistic.keywords
+    else:
+        return None
+    if options.get('visualize'):
+        return None
+    return {
+        'zero_based_j': options.get('zero_based_j', True),
+        'divide_by_n': options.get('divide_by_n', True)
+    }
+
+
+def signature_positions(signatures: DataFrame, start, stop, rank_store: RankStore = None) -> np.ndarray:
+    """V(j) of the genes in the signatures[start:stop]: ranks of the values in the increasing order, + 1"""
+    if rank_store:
+        return rank_store.ascending_ranks(signatures.columns[start:stop], signatures.index) + 1
+    return rankdata(signatures.values[:, start:stop], axis=0) + 1
+
+
+def tag_masks(positions: np.ndarray, n_genes: int) -> np.ndarray:
+    """Boolean (genes x signatures) mask of the positions from split_matrix() (one row per signature, padded with -1)"""
+    # the padding falls into an extra row, dropped afterwards
+    mask = np.zeros((n_genes + 1, len(positions)), dtype=bool)
+    mask[positions.T, np.arange(len(positions))] = True
+    return mask[:-1]
+
+
+def batch_connectivity_scores(
+    disease_profile: Profile, signatures: DataFrame, ranks_type='signature',
+    compose_tags=conditional_difference, factor=1, zero_based_j=True, divide_by_n=True,
+    block_size=1000, rank_store: RankStore = None, split=Signature.split_matrix
+) -> np.ndarray:
+    """Connectivity scores (KS statistic) of all the signatures (genes x signatures) at once.
+
+    Equivalent to scoring each of the signatures with the scorer from create_scorer(),
+    except for signatures without up- or down-regulated genes (ranks_type='disease'),
+    for which the statistic of the empty tag list is 0.
+
+    Args:
+        rank_store: precomputed ranks of the signatures over the same genes,
+            used instead of ranking the signatures (ranks_type='signature')
+        split: split_matrix() of the signature type, selecting the up- and down-regulated
+            genes of the signatures (ranks_type='disease')
+    """
+    genes = signatures.index
+    values = signatures.values
+    n_signatures = values.shape[1]
+    ks = {'up': np.empty(n_signatures), 'down': np.empty(n_signatures)}
+
+    if ranks_type == 'disease':
+        # V(j) of the disease genes
+        disease_positions = disease_profile.full.ranks.rank(ascending=False) + 1
+        n = len(disease_positions)
+        positions = disease_positions.reindex(genes).values
+        retained = ~np.isnan(positions)
+        # order the genes of the signatures as in the sorted disease instance
+        order = np.flatnonzero(retained)[np.argsort(positions[retained], kind='stable')]
+        positions = positions[order, np.newaxis]
+    else:
+        tag_rows = {
+            tag_name: np.flatnonzero(genes.isin(tag_list.index))
+            for tag_name, tag_list in [('up', disease_profile.top.up), ('down', disease_profile.top.down)]
+        }
+        t = {'up': len(disease_profile.top.up), 'down': len(disease_profile.top.down)}
+        n = len(genes)
+
+    for start in range(0, n_signatures, block_size):
+        block = values[:, start:start + block_size]
+        if ranks_type == 'disease':
+            if split == Signature.split_matrix:
+                # all the genes of the full profiles, by the sign
+                tags = {'up': block > 0, 'down': block < 0}
+            else:
+                down, up = split(block, block.shape[0])
+                tags = {'up': tag_masks(up, block.shape[0]), 'down': tag_masks(down, block.shape[0])}
+            tags = {tag_name: mask[order] for tag_name, mask in tags.items()}
+            for tag_name, mask in tags.items():
+                tag_t = mask.sum(axis=0)
+                ks[tag_name][start:start + block_size] = batch_kolmogorov_smirnov(
+                    positions, mask, tag_t,
+                    n if divide_by_n else n - tag_t,
+                    zero_based_j=zero_based_j
+                )
+        else:
+            block_positions = signature_positions(signatures, start, start + block_size, rank_store)
+            for tag_name, rows in tag_rows.items():
+                tag_positions = np.sort(block_positions[rows], axis=0)
+                ks[tag_name][start:start + block_size] = batch_kolmogorov_smirnov(
+                    tag_positions, np.ones_like(tag_positions, dtype=bool), t[tag_name],
+                    n if divide_by_n else n - t[tag_name],
+                    zero_based_j=zero_based_j
+                )
+
+    return np.vectorize(compose_tags, otypes=[float])(ks['up'], ks['down'], factor)
+
+
 def create_scorer(
     negative,
     statistic=kolmogorov_smirnov,
@@ -246,8 +517,24 @@ def create_scorer(
         '_' + statistic.__name__ +
         '_' + compose_tags.__name__
     )
+    ks_options = kolmogorov_smirnov_options(statistic)
+
+    def batch_connectivity_score(
+        disease_profile: Profile, signatures: DataFrame, rank_store=None, split=Signature.split_matrix, **kwargs
+    ) -> Dict[str, float]:
+        # the full ranks do not depend on the limit nor on the gene selection
+        scores = batch_connectivity_scores(
+            disease_profile, signatures, ranks_type=ranks_type, compose_tags=compose_tags,
+            factor=-1 if negative else 1, rank_store=rank_store, split=split, **ks_options
+        )
+        return dict(zip(signatures.columns, scores))
+
     return scoring_function(
-        compile_with_inline(connectivity_score, name, copy(locals()), {'force_custom_tags': force_custom_tags, **globals(), **locals()})
+        compile_with_inline(connectivity_score, name, copy(locals()), {'force_custom_tags': force_custom_tags, **globals(), **locals()}),
+        # the batch engine only implements the KS statistic with the tags derived from the profiles
+        batch=batch_connectivity_score if ks_options and not force_custom_tags else None,
+        # the ranks come from the full profiles; only the tags of the disease are limited to the top genes
+        profile_parts=('full',) if ranks_type == 'disease' else ('top', 'full')
     )
 
 
@@ -0,0 +1,185 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pandas import DataFrame
+from statsmodels.stats.multitest import multipletests
+
+from data_sources.rank_store import RankStore
+
+from ..models import Profile
+from .connectivity_score import (
+    batch_connectivity_scores, batch_kolmogorov_smirnov, conditional_difference, signature_positions
+)
+
+
+def random_tag_positions(n, sizes: Dict[str, int], permutations, random_state: np.random.RandomState) -> Dict[str, np.ndarray]:
+    """Positions (in the sorted instance of n genes) of random tag sets of given sizes, disjoint within each permutation.
+
+    Returns:
+        sorted positions (size x permutations) for each of the tag sets
+    """
+    total = sum(sizes.values())
+    assert total <= n
+    bounds = np.cumsum(list(sizes.values()))
+    keys = random_state.random_sample((permutations, n))
+    # the genes with the smallest keys form the first tag set, the following ones the next set, etc.
+    kth = [bound - 1 for bound in bounds if bound]
+    chosen = np.argpartition(keys, kth, axis=1)[:, :total] if kth else np.empty((permutations, 0), dtype=int)
+    return {
+        tag_name: np.sort(chosen[:, end - size:end].T, axis=0)
+        for (tag_name, size), end in zip(sizes.items(), bounds)
+    }
+
+
+def rank_groups(signatures: DataFrame, rank_store: RankStore = None, block_size=1000):
+    """Group the signatures by the multiset of their ranks.
+
+    The distribution of the KS statistic over random tag sets depends only on the multiset
+    of the ranks, which is the same for all signatures without ties (1, 2, ..., n); ties
+    (average ranks) create separate groups.
+
+    Returns:
+        group of each of the signatures and, for each of the groups, the ties: positions
+        in the sorted instance where V(j) differs from V(j) without ties, and V(j) at these positions
+    """
+    n, n_signatures = signatures.shape
+    without_ties = np.arange(2, n + 2)
+    groups = np.empty(n_signatures, dtype=int)
+    group_by_ranks = {}
+    ties = []
+
+    for start in range(0, n_signatures, block_size):
+        positions = np.sort(signature_positions(signatures, start, start + block_size, rank_store), axis=0)
+        for i in range(positions.shape[1]):
+            tied = np.flatnonzero(positions[:, i] != without_ties)
+            key = tied.tobytes() + positions[tied, i].tobytes()
+            if key not in group_by_ranks:
+                group_by_ranks[key] = len(ties)
+                ties.append((tied, positions[tied, i]))
+            groups[start + i] = group_by_ranks[key]
+
+    return groups, ties
+
+
+def null_connectivity_scores(
+    n, ties: List[Tuple[np.ndarray, np.ndarray]], tag_positions: Dict[str, np.ndarray], t: Dict[str, int],
+    compose_tags=conditional_difference, factor=1, zero_based_j=True, divide_by_n=True
+) -> np.ndarray:
+    """Connectivity scores of the random tag sets against instances of n genes with given ties (see rank_groups).
+
+    As the tag positions are sorted, V(j) of the tags are in the order of the sorted instance.
+    The scores are computed once for an instance without ties; for the other instances only
+    the permutations with tags at the positions affected by the ties are scored again.
+
+    Returns:
+        scores (instances x permutations)
+    """
+    without_ties = np.arange(2, n + 2)
+    compose = np.vectorize(compose_tags, otypes=[float])
+    permutations = next(iter(tag_positions.values())).shape[1]
+
+    def score(v, selected=slice(None)):
+        ks = {}
+        for tag_name, positions in tag_positions.items():
+            tag_v = v[positions[:, selected]]
+            if not len(tag_v):
+                # the statistic of an empty tag list
+                ks[tag_name] = np.zeros(tag_v.shape[1])
+                continue
+            ks[tag_name] = batch_kolmogorov_smirnov(
+                tag_v, np.ones_like(tag_v, dtype=bool), t[tag_name],
+                n if divide_by_n else n - t[tag_name],
+                zero_based_j=zero_based_j
+            )
+        return compose(ks['up'], ks['down'], factor)
+
+    # permutations (columns) of the tags at each of the positions, by the position
+    tags = np.concatenate([positions for positions in tag_positions.values()]).ravel()
+    by_position = np.argsort(tags, kind='stable')
+    sorted_tags = tags[by_position]
+    permutation_of_tag = by_position % permutations
+
+    scores = np.tile(score(without_ties), (len(ties), 1))
+
+    for instance, (tied, values) in enumerate(ties):
+        if not len(tied):
+            continue
+        starts = np.searchsorted(sorted_tags, tied, side='left')
+        ends = np.searchsorted(sorted_tags, tied, side='right')
+        affected = np.unique(np.concatenate([permutation_of_tag[start:end] for start, end in zip(starts, ends)]))
+        if len(affected):
+            v = without_ties.astype(float)
+            v[tied] = values
+            scores[instance, affected] = score(v, affected)
+
+    return scores
+
+
+def connectivity_significance(
+    disease_profile: Profile, signatures: DataFrame, permutations=1000,
+    compose_tags=conditional_difference, factor=1, zero_based_j=True, divide_by_n=True,
+    rank_store: RankStore = None, random_state=None, block_size=1000
+) -> DataFrame:
+    """Significance of the connectivity scores (ranks_type='signature', KS statistic) of all the signatures.
+
+    The scores of random tag sets (of the same sizes as the up- and down-regulated genes
+    of the disease) are computed against the ranks of the signatures, once for each multiset
+    of ranks (see rank_groups), so that the null distributions are shared by the signatures;
+    the same random tag sets are used for all the signatures.
+
+    Args:
+        signatures: genes x signatures, limited to the genes considered in scoring
+        compose_tags, factor, zero_based_j, divide_by_n: options of the scorer, see create_scorer()
+        rank_store: precomputed ranks of the signatures over the same genes
+
+    Returns:
+        data frame (indexed by signatures) with the raw scores ('score'), normalized
+        connectivity scores ('ncs': the scores divided by the mean of the null scores of the
+        same sign, as in CMap), two-sided permutation p-values ('p_value') and Benjamini-Hochberg
+        false discovery rates ('fdr')
+    """
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    options = dict(compose_tags=compose_tags, factor=factor, zero_based_j=zero_based_j, divide_by_n=divide_by_n)
+
+    scores = batch_connectivity_scores(
+        disease_profile, signatures, ranks_type='signature',
+        block_size=block_size, rank_store=rank_store, **options
+    )
+
+    tags = {'up': disease_profile.top.up, 'down': disease_profile.top.down}
+    sizes = {tag_name: int(signatures.index.isin(tag_list.index).sum()) for tag_name, tag_list in tags.items()}
+    t = {tag_name: len(tag_list) for tag_name, tag_list in tags.items()}
+    tag_positions = random_tag_positions(len(signatures.index), sizes, permutations, random_state)
+
+    groups, ties = rank_groups(signatures, rank_store, block_size=block_size)
+    null = null_connectivity_scores(len(signatures.index), ties, tag_positions, t, **options)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        positive_mean = np.where(null > 0, null, 0).sum(axis=1) / (null > 0).sum(axis=1)
+        negative_mean = -np.where(null < 0, null, 0).sum(axis=1) / (null < 0).sum(axis=1)
+        ncs = np.where(
+            scores == 0, 0,
+            scores / np.where(scores > 0, positive_mean[groups], negative_mean[groups])
+        )
+
+    # the number of null scores at least as extreme as the observed one
+    absolute_null = np.sort(np.abs(null), axis=1)
+    more_extreme = np.empty(len(scores))
+    by_group = np.argsort(groups, kind='stable')
+    bounds = np.searchsorted(groups[by_group], np.arange(len(absolute_null) + 1))
+    for group, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        members = by_group[start:end]
+        more_extreme[members] = permutations - np.searchsorted(absolute_null[group], np.abs(scores[members]))
+    p_values = (more_extreme + 1) / (permutations + 1)
+
+    return DataFrame(
+        {
+            'score': scores,
+            'ncs': ncs,
+            'p_value': p_values,
+            'fdr': multipletests(p_values, method='fdr_bh')[1]
+        },
+        index=signatures.columns
+    )
@@ -1,12 +1,172 @@
-from pandas import concat
+import numpy as np
+from pandas import DataFrame, Series, concat
 from scipy.stats import spearmanr
-from scipy import spatial
+from scipy import sparse, spatial
 
-from ..models import Profile, ScoringData
+from ..models import Profile, ScoringData, Signature
 from . import scoring_function
 
 
-@scoring_function
+# the scorers of this module read only the top genes of the profiles
+TOP = ('top',)
+
+
+def changed_subsets(disease: ScoringData, compound: ScoringData):
+    changed_by_compound_series = concat([compound.down, compound.up])
+    # the genes are matched by their codes (integers) rather than by the identifiers
+    changed_by_compound = np.concatenate([compound.down_codes, compound.up_codes])
+    genes = changed_by_compound_series.index
+
+    x_up_in_disease = genes[np.isin(changed_by_compound, disease.up_codes)]
+    x_down_in_disease = genes[np.isin(changed_by_compound, disease.down_codes)]
+
+    return changed_by_compound_series, x_down_in_disease, x_up_in_disease
+
+
+def gather(values: np.ndarray, positions: np.ndarray, fill=0) -> np.ndarray:
+    """Values of the (genes x signatures) matrix at the positions of genes of each signature
+    (signatures x positions, as returned by split_matrix()); the padding is replaced with fill"""
+    signatures = np.arange(positions.shape[0])[:, np.newaxis]
+    return np.where(positions >= 0, values[positions, signatures], fill)
+
+
+def changed_subsets_sums(disease: ScoringData, signatures: DataFrame, limit, split=Signature.split_matrix, block_size=10000):
+    """Sums over the changed subsets for all signatures (genes x signatures) at once.
+
+    The top up- and down-regulated genes of each signature are selected with split
+    (as Signature.split with Series.nlargest would); the selected fold changes form a sparse
+    (signatures x genes) matrix which is multiplied by the indicators (and by the values)
+    of the disease up- and down-regulated genes.
+
+    Returns:
+        dict of arrays with the sums of compound values over x_up_in_disease ('up')
+        and x_down_in_disease ('down'), and of the products of compound and disease values
+        over these sets ('up_product' and 'down_product')
+    """
+    genes = signatures.index
+    weights = np.column_stack([
+        genes.isin(disease.up.index),
+        genes.isin(disease.down.index),
+        disease.up.reindex(genes).fillna(0).values,
+        disease.down.reindex(genes).fillna(0).values
+    ]).astype(float)
+
+    values = signatures.values
+    n_signatures = values.shape[1]
+    sums = np.empty((n_signatures, weights.shape[1]))
+
+    for start in range(0, n_signatures, block_size):
+        block = values[:, start:start + block_size]
+        changed_by_compound = np.hstack(split(block, limit))
+        selected = changed_by_compound >= 0
+        changed = sparse.csr_matrix(
+            (
+                gather(block, changed_by_compound)[selected].astype(float),
+                changed_by_compound[selected],
+                np.concatenate([[0], np.cumsum(selected.sum(axis=1))])
+            ),
+            shape=(block.shape[1], block.shape[0])
+        )
+        sums[start:start + block_size] = changed @ weights
+
+    return dict(zip(['up', 'down', 'up_product', 'down_product'], sums.T))
+
+
+def masked_ranks(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Ranks of the values in each row (average for ties), considering only the masked entries (others are NaN)"""
+    return DataFrame(np.where(mask, values, np.nan)).rank(axis=1).values
+
+
+def masked_correlation(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pearson correlation of the rows of a with the corresponding rows of b, skipping NaN entries"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centered = []
+        for x in [a, b]:
+            mean = np.nansum(x, axis=1) / (~np.isnan(x)).sum(axis=1)
+            centered.append(np.nan_to_num(x - mean[:, np.newaxis]))
+        a, b = centered
+        return np.einsum('ij,ij->i', a, b) / np.sqrt(np.einsum('ij,ij->i', a, a) * np.einsum('ij,ij->i', b, b))
+
+
+def spearman_correlations(disease: ScoringData, signatures: DataFrame, limit, split=Signature.split_matrix, block_size=10000):
+    """Spearman correlations between the values of top up- (and down-) regulated genes
+    of all the signatures (genes x signatures) and the disease ranks of these genes.
+
+    Returns:
+        dict of arrays with correlations over the up ('up') and down ('down') regulated genes
+    """
+    disease_ranks = disease.ranks.reindex(signatures.index).values
+    values = signatures.values
+    n_signatures = values.shape[1]
+    correlations = {'up': np.empty(n_signatures), 'down': np.empty(n_signatures)}
+
+    for start in range(0, n_signatures, block_size):
+        block = values[:, start:start + block_size]
+        down, up = split(block, limit)
+        for tag_name, positions in [('up', up), ('down', down)]:
+            selected = positions >= 0
+            # only the selected genes are gathered, and spearmanr re-ranks both vectors within these
+            disease_block = np.where(selected, disease_ranks[positions], np.nan)
+            correlation = masked_correlation(
+                masked_ranks(gather(block, positions), selected),
+                masked_ranks(disease_block, selected)
+            )
+            # genes without the disease rank result in NaN, as in the per-signature version
+            correlation[(selected & np.isnan(disease_block)).any(axis=1)] = np.nan
+            correlations[tag_name][start:start + block_size] = correlation
+
+    return correlations
+
+
+def cosine_distances(disease: ScoringData, signatures: DataFrame, limit, split=Signature.split_matrix, block_size=10000):
+    """Cosine distances between the top up- and down-regulated genes of all the signatures
+    (genes x signatures) and of the disease, over the genes changed in both."""
+    genes = signatures.index
+    disease_values = concat([disease.up, disease.down])
+    in_disease = genes.isin(disease_values.index).astype(float)
+    disease_values = disease_values.reindex(genes).fillna(0).values
+
+    values = signatures.values
+    n_signatures = values.shape[1]
+    distances = np.empty(n_signatures)
+
+    for start in range(0, n_signatures, block_size):
+        block = values[:, start:start + block_size]
+        changed_by_compound = np.hstack(split(block, limit))
+        selected = changed_by_compound >= 0
+        compound_values = gather(block, changed_by_compound).astype(float)
+        # the disease values are zero outside of the disease top genes, so the products
+        # are limited to the genes changed both in the disease and by the compound
+        disease_block = np.where(selected, disease_values[changed_by_compound], 0)
+        dot = np.einsum('ij,ij->i', compound_values, disease_block)
+        disease_norm = np.einsum('ij,ij->i', disease_block, disease_block)
+        compound_norm = np.einsum('ij,ij->i', np.square(compound_values), np.where(selected, in_disease[changed_by_compound], 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances[start:start + block_size] = np.clip(1 - dot / np.sqrt(disease_norm * compound_norm), 0, 2)
+
+    return {'distance': distances}
+
+
+def batch_scorer(compute, compose):
+    """Create the batch counterpart of a scorer, given a function computing
+    the statistics for all signatures at once and a function deriving the scores from these"""
+
+    def batch(
+        disease_profile: Profile, signatures: DataFrame, limit=None,
+        gene_selection=Series.nlargest, split=Signature.split_matrix, **kwargs
+    ):
+        if gene_selection is not Series.nlargest:
+            return None
+        statistics = compute(disease_profile.top, signatures, limit or signatures.shape[0], split=split)
+        return dict(zip(signatures.columns, compose(statistics)))
+
+    return batch
+
+
+@scoring_function(
+    batch=batch_scorer(spearman_correlations, lambda correlations: correlations['down'] + correlations['up']),
+    profile_parts=TOP
+)
 def score_spearman(disease_profile: Profile, compound_profile: Profile):
 
     down_ranks = compound_profile.top.down.index
@@ -23,7 +183,14 @@ def score_spearman(disease_profile: Profile, compound_profile: Profile):
     return s_dn + s_up
 
 
-@scoring_function
+@scoring_function(
+    batch=batch_scorer(
+        spearman_correlations,
+        # as max([s_dn, s_up])
+        lambda correlations: np.where(correlations['up'] > correlations['down'], correlations['up'], correlations['down'])
+    ),
+    profile_parts=TOP
+)
 def score_spearman_max(disease_profile: Profile, compound_profile: Profile):
 
     down_ranks = compound_profile.top.down.index
@@ -40,17 +207,10 @@ def score_spearman_max(disease_profile: Profile, compound_profile: Profile):
     return max([s_dn, s_up])
 
 
-def changed_subsets(disease: ScoringData, compound: ScoringData):
-    changed_by_compound_series = concat([compound.down, compound.up])
-    changed_by_compound = set(changed_by_compound_series.index)
-
-    x_up_in_disease = changed_by_compound.intersection(disease.up.index)
-    x_down_in_disease = changed_by_compound.intersection(disease.down.index)
-
-    return changed_by_compound_series, x_down_in_disease, x_up_in_disease
-
-
-@scoring_function
+@scoring_function(
+    batch=batch_scorer(changed_subsets_sums, lambda sums: sums['down'] - sums['up']),
+    profile_parts=TOP
+)
 def x_sum(disease_profile: Profile, compound_profile: Profile):
     """Algorithm:
 
@@ -77,7 +237,10 @@ def x_sum(disease_profile: Profile, compound_profile: Profile):
     return changed_by_compound[x_down_in_disease].sum() - changed_by_compound[x_up_in_disease].sum()
 
 
-@scoring_function
+@scoring_function(
+    batch=batch_scorer(changed_subsets_sums, lambda sums: np.maximum(sums['down'], -sums['up'])),
+    profile_parts=TOP
+)
 def x_sum_max(disease_profile: Profile, compound_profile: Profile):
 
     changed_by_compound, x_down_in_disease, x_up_in_disease = changed_subsets(
@@ -90,7 +253,10 @@ def x_sum_max(disease_profile: Profile, compound_profile: Profile):
     ])
 
 
-@scoring_function
+@scoring_function(
+    batch=batch_scorer(changed_subsets_sums, lambda sums: - sums['down_product'] - sums['up_product']),
+    profile_parts=TOP
+)
 def x_product(disease_profile: Profile, compound_profile: Profile):
 
     changed_by_compound, x_down_in_disease, x_up_in_disease = changed_subsets(
@@ -105,7 +271,10 @@ def x_product(disease_profile: Profile, compound_profile: Profile):
     )
 
 
-@scoring_function
+@scoring_function(
+    batch=batch_scorer(cosine_distances, lambda distances: distances['distance']),
+    profile_parts=TOP
+)
 def x_cos(disease_profile: Profile, compound_profile: Profile):
     changed_by_compound, x_down_in_disease, x_up_in_disease = changed_subsets(
         disease_profile.top, compound_profile.top
@@ -114,17 +283,19 @@ def x_cos(disease_profile: Profile, compound_profile: Profile):
     full_disease = concat([disease_profile.top.up, disease_profile.top.down])
     full_compound = concat([compound_profile.top.up, compound_profile.top.down])
 
-    changed_in_disease = set(full_disease.index)
-
-    x_set = changed_in_disease.intersection(changed_by_compound.index)
+    changed_in_disease = np.concatenate([disease_profile.top.up_codes, disease_profile.top.down_codes])
+    changed_in_compound = np.concatenate([compound_profile.top.up_codes, compound_profile.top.down_codes])
 
-    disease = full_disease[full_disease.index[full_disease.index.isin(x_set)]]
+    disease = full_disease[np.isin(changed_in_disease, changed_in_compound)]
     drug = full_compound.loc[disease.index]
 
     return spatial.distance.cosine(drug.values, disease.values)
 
 
-@scoring_function
+@scoring_function(
+    batch=batch_scorer(changed_subsets_sums, lambda sums: np.maximum(-sums['down_product'], -sums['up_product'])),
+    profile_parts=TOP
+)
 def x_product_max(disease_profile: Profile, compound_profile: Profile):
 
     changed_by_compound, x_down_in_disease, x_up_in_disease = changed_subsets(
@@ -3,7 +3,7 @@ from tempfile import NamedTemporaryFile
 from typing import Union, Set
 from warnings import warn
 
-from pandas import concat
+from pandas import DataFrame, concat
 
 from data_frames import AugmentedDataFrame
 from data_sources.molecular_signatures_db import MolecularSignaturesDatabase
@@ -134,34 +134,30 @@ def create_gsea_scorer(
         )
         return DummyExpressionsWithControls.from_differential(case_expression, case_name=class_name)
 
-    def gsea_score(
-        disease: Union[Profile, ExpressionWithControls],
-        compound: Union[Profile, ExpressionWithControls],
-        warn_about_cache=True
-    ):
-        multiprocess_cache_manager.respawn_cache_if_needed()
-
-        if isinstance(disease, Profile):
-            disease_expression = to_dummy_expression(disease, 'disease')
-            compound_expression = to_dummy_expression(compound, 'signature')
-        else:
-            disease_expression = disease
-            compound_expression = compound
-
-        gsea = partial(
-            gsea_app.run,
-            gene_sets=gene_sets_path, id_type=id_type,
-            permutations=permutations, permutation_type=permutation_type,
-            metric=metric,
-            normalization='meandiv' if normalization else None,
-            verbose=verbose,
-            min_genes=min_genes, max_genes=max_genes
-        )
+    def to_expression(profile: Union[Profile, ExpressionWithControls], class_name: str):
+        if isinstance(profile, Profile):
+            return to_dummy_expression(profile, class_name)
+        return profile
+
+    gsea = partial(
+        gsea_app.run,
+        gene_sets=gene_sets_path, id_type=id_type,
+        permutations=permutations, permutation_type=permutation_type,
+        metric=metric,
+        normalization='meandiv' if normalization else None,
+        verbose=verbose,
+        min_genes=min_genes, max_genes=max_genes
+    )
+
+    def prepare_disease(disease: Union[Profile, ExpressionWithControls], warn_about_cache=True):
+        """Gene sets enriched in the disease (passing the q-value cutoff)"""
+        if cache:
+            multiprocess_cache_manager.respawn_cache_if_needed()
 
         try:
             disease_gene_sets_up, disease_gene_sets_dn = cached_gsea_run(
                 gsea_app,
-                gsea, gene_sets, disease_expression, class_name='disease',
+                gsea, gene_sets, to_expression(disease, 'disease'), class_name='disease',
                 warn_when_not_using_cache=warn_about_cache,
                 cache=cache
                 # delete=False might be beneficial for single runs (if these were to be restarted after the cache is gone)
@@ -170,22 +166,29 @@ def create_gsea_scorer(
         except GSEAError as e:
             raise ScoringError(f'Diseases scoring failed, all the substances are doomed to fail; original error: {e}')
 
+        results = [disease_gene_sets_up, disease_gene_sets_dn]
+
+        if q_value_cutoff:
+            results = [
+                result[~(result['fdr_q-val'] > q_value_cutoff)]
+                for result in results
+            ]
+
+        return concat(results)
+
+    def gsea_score(disease_gene_sets: DataFrame, compound: Union[Profile, ExpressionWithControls]):
+        if cache and cache_signatures:
+            multiprocess_cache_manager.respawn_cache_if_needed()
+
         try:
             signature_gene_sets_up, signature_gene_sets_dn = cached_gsea_run(
                 gsea_app,
-                gsea, gene_sets, compound_expression, class_name='signature',
+                gsea, gene_sets, to_expression(compound, 'signature'), class_name='signature',
                 cache=cache and cache_signatures
             )
         except GSEAError:
             return None
 
-        results = [disease_gene_sets_up, disease_gene_sets_dn]
-
-        if q_value_cutoff:
-            for result in results:
-                result.drop(result[result['fdr_q-val'] > q_value_cutoff].index, inplace=True)
-
-        disease_gene_sets = concat([disease_gene_sets_up, disease_gene_sets_dn])
         signature_gene_sets = concat([signature_gene_sets_up, signature_gene_sets_dn])
 
         joined = combine_gsea_results(disease_gene_sets, signature_gene_sets, na_action)
@@ -210,6 +213,8 @@ def create_gsea_scorer(
         gsea_score, input=input, grouping=grouping,
         custom_multiprocessing=custom_multiprocessing,
         before_batch=lambda: gsea_app.prepare_output(),
-        supports_cache=True
+        supports_cache=True,
+        prepare=prepare_disease,
+        profile_parts=('top',)
     )
 
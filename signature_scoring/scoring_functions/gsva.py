@@ -142,7 +142,8 @@ def create_gsva_scorer(
 
     input = Profile if single_sample else ExpressionWithControls
 
-    def gsva_score(disease: input, compound: input, cores=1):
+    def prepare_disease(disease: input, cores=1):
+        """Gene sets enriched in the disease (passing the q-value cutoff)"""
         if not custom_multiprocessing:
             multiprocess_cache_manager.respawn_cache_if_needed()
 
@@ -151,9 +152,15 @@ def create_gsva_scorer(
             permutations=permutations, mx_diff=mx_diff, cores=cores
         )
 
-        disease_gene_sets.drop(disease_gene_sets[disease_gene_sets['fdr_q-val'] > q_value_cutoff].index, inplace=True)
+        disease_gene_sets = disease_gene_sets[~(disease_gene_sets['fdr_q-val'] > q_value_cutoff)]
 
         assert len(disease_gene_sets.index)
+        return disease_gene_sets
+
+    def gsva_score(disease_gene_sets: DataFrame, compound: input, cores=1):
+        if not custom_multiprocessing:
+            multiprocess_cache_manager.respawn_cache_if_needed()
+
         signature_gene_sets = gsva(
             compound, gene_sets_path=gene_sets_file.name, method=method, single_sample=single_sample,
             permutations=permutations, mx_diff=mx_diff, _cache=False, cores=cores,
@@ -173,4 +180,8 @@ def create_gsva_scorer(
         ('_single_sample' if single_sample else '')
     )
 
-    return scoring_function(gsva_score, input=input, grouping=grouping, custom_multiprocessing=custom_multiprocessing)
+    return scoring_function(
+        gsva_score, input=input, grouping=grouping, custom_multiprocessing=custom_multiprocessing,
+        prepare=prepare_disease,
+        profile_parts=('top',)
+    )
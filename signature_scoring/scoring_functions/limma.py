@@ -77,19 +77,32 @@ def create_roast_scorer(
     def set_gene_set_collection():
         globalenv[gene_sets] = gene_sets_r
 
-    def roast_score(disease: ExpressionWithControls, compound: ExpressionWithControls):
+    def prepare_disease(disease: ExpressionWithControls):
+        """Gene sets enriched in the disease (passing the q-value cutoff), or None if roast failed"""
+        if cache:
+            multiprocess_cache_manager.respawn_cache_if_needed()
+
+        try:
+            disease_gene_sets = roast(disease, gene_sets=gene_sets, use_cache=cache)
+        except RRuntimeError as e:
+            # none of the substances will be scored, but the run goes on
+            print(e)
+            return None
+        return disease_gene_sets[~(disease_gene_sets['fdr_q-val'] > q_value_cutoff)]
+
+    def roast_score(disease_gene_sets: DataFrame, compound: ExpressionWithControls):
 
         if len(compound.cases.columns) < 2 or len(compound.controls.columns) < 2:
             print(f'Skipping {compound} not enough degrees of freedom (no way to compute in-group variance)')
             return None
 
-        if cache:
+        if disease_gene_sets is None:
+            return None
+
+        if cache and cache_signatures:
             multiprocess_cache_manager.respawn_cache_if_needed()
 
         try:
-            disease_gene_sets = roast(disease, gene_sets=gene_sets, use_cache=cache)
-            disease_gene_sets.drop(disease_gene_sets[disease_gene_sets['fdr_q-val'] > q_value_cutoff].index, inplace=True)
-
             signature_gene_sets = roast(compound, gene_sets=gene_sets, use_cache=cache and cache_signatures)
 
             joined = combine_gsea_results(disease_gene_sets, signature_gene_sets, na_action)
@@ -104,5 +117,6 @@ def create_roast_scorer(
 
     return scoring_function(
         roast_score, input=ExpressionWithControls, grouping=grouping,
-        before_batch=set_gene_set_collection
+        before_batch=set_gene_set_collection,
+        prepare=prepare_disease
     )
@@ -1,8 +1,19 @@
+from numpy import allclose, sign
+from numpy.random import RandomState
 from pandas import Series, DataFrame
+from pytest import approx
 
+from data_sources.rank_store import RankStore
 from signature_scoring import score_signatures
 from signature_scoring.models import Profile
-from signature_scoring.scoring_functions.connectivity_score import create_scorer
+from signature_scoring.processor.fold_change import FoldChangeSignature
+from signature_scoring.scoring_functions.connectivity_score import (
+    create_scorer, create_kolmogorov_smirnov, create_generalized_kolmogorov_smirnov, kolmogorov_smirnov, kolmogorov_smirnov_options,
+    batch_connectivity_scores, difference, conditional_difference, max_up_or_down
+)
+from signature_scoring.scoring_functions.connectivity_significance import (
+    connectivity_significance, null_connectivity_scores, random_tag_positions, rank_groups
+)
 
 
 # query = dcm.from_perturbations(['vemurafenib'])
@@ -62,3 +73,142 @@ def test_connectivity_score():
 
     scores = score_signatures(reverse_connectivity_score, query, DataFrame(query), limit=None, processes=1)
     assert scores[query.name] < 0
+
+
+def test_batch_connectivity_scores():
+    random = RandomState(0)
+    genes = [str(i).encode() for i in range(200)]
+    # rounding introduces ties and zeros
+    signatures = DataFrame(random.randn(200, 50).round(1), index=genes)
+    disease = Series(random.randn(200).round(1), index=genes)
+
+    for ranks_type in ['signature', 'disease']:
+        for compose_tags in [difference, conditional_difference, max_up_or_down]:
+            for statistic in [kolmogorov_smirnov, create_kolmogorov_smirnov(proper_ks=False, denominator='n-t')]:
+                scorer = create_scorer(negative=True, statistic=statistic, ranks_type=ranks_type, compose_tags=compose_tags)
+                disease_profile = Profile(disease, limit=25)
+                expected = [
+                    scorer(disease_profile, Profile(signatures[signature], limit=25))
+                    for signature in signatures.columns
+                ]
+                scores = batch_connectivity_scores(
+                    disease_profile, signatures, ranks_type=ranks_type, compose_tags=compose_tags,
+                    factor=-1, block_size=16, **kolmogorov_smirnov_options(statistic)
+                )
+                assert allclose(scores, expected)
+
+
+def test_connectivity_score_profile_parts():
+    random = RandomState(0)
+    genes = [str(i).encode() for i in range(200)]
+    disease = Series(random.randn(200), index=genes)
+    signature = Series(random.randn(200), index=genes)
+
+    for ranks_type in ['signature', 'disease']:
+        scorer = create_scorer(negative=True, ranks_type=ranks_type)
+        disease_profile = Profile(disease, limit=25, parts=scorer.profile_parts)
+        compound_profile = Profile(signature, limit=25, parts=scorer.profile_parts)
+
+        score = scorer(disease_profile, compound_profile)
+        assert score == scorer(Profile(disease, limit=25), Profile(signature, limit=25))
+
+        # the top genes of the compound profiles are never selected
+        assert compound_profile._top is None
+        if ranks_type == 'disease':
+            assert scorer.profile_parts == ('full',)
+            assert disease_profile._top is None
+
+
+def test_batch_connectivity_scores_split():
+    random = RandomState(0)
+    genes = [str(i).encode() for i in range(200)]
+    signatures = DataFrame(random.randn(200, 50).round(1) * 3, index=genes)
+    disease = Series(random.randn(200).round(1) * 3, index=genes)
+
+    # the tags of the signatures are selected as by the split() of the signature type
+    scorer = create_scorer(negative=True, ranks_type='disease', compose_tags=difference)
+    disease_profile = Profile(FoldChangeSignature(disease), limit=25)
+    expected = [
+        scorer(disease_profile, Profile(FoldChangeSignature(signatures[signature]), limit=25))
+        for signature in signatures.columns
+    ]
+    scores = batch_connectivity_scores(
+        disease_profile, signatures, ranks_type='disease', compose_tags=difference,
+        factor=-1, block_size=16, split=FoldChangeSignature.split_matrix
+    )
+    assert allclose(scores, expected)
+
+
+def test_batch_connectivity_scores_with_rank_store(tmp_path):
+    random = RandomState(0)
+    genes = [str(i).encode() for i in range(200)]
+    signatures = DataFrame(random.randn(200, 50).round(1), index=genes, columns=[f'S{i}' for i in range(50)])
+    disease_profile = Profile(Series(random.randn(200).round(1), index=genes), limit=25)
+
+    # the ranks were computed over the genes in a different order
+    shuffled = signatures.sample(frac=1, random_state=random)
+    rank_store = RankStore.convert([shuffled.values], shuffled.index, shuffled.columns, tmp_path, progress=False)
+
+    assert allclose(
+        batch_connectivity_scores(disease_profile, signatures, block_size=16, rank_store=rank_store),
+        batch_connectivity_scores(disease_profile, signatures, block_size=16)
+    )
+
+
+def test_compiled_kolmogorov_smirnov():
+    random = RandomState(0)
+    genes = [str(i).encode() for i in range(300)]
+    instance = Series(random.randn(300).round(1), index=genes).sort_values(ascending=False)
+    tags = Series(1, index=random.choice(genes, 50, replace=False))
+
+    for proper_ks in [True, False]:
+        for denominator in ['n', 'n-t']:
+            statistic = create_kolmogorov_smirnov(proper_ks=proper_ks, denominator=denominator)
+            compiled = create_kolmogorov_smirnov(proper_ks=proper_ks, denominator=denominator, compiled=True)
+            assert compiled(instance, tags) == statistic(instance, tags)
+
+    for p in [0, 1, 2]:
+        statistic = create_generalized_kolmogorov_smirnov(p)
+        compiled = create_generalized_kolmogorov_smirnov(p, compiled=True)
+        assert compiled(instance, tags) == statistic(instance, tags)
+
+    profile = Profile(query)
+    scorer = create_scorer(negative=False, statistic=create_kolmogorov_smirnov(compiled=True))
+    assert scorer(profile, profile) == create_scorer(negative=False)(profile, profile)
+
+
+def test_connectivity_significance():
+    random = RandomState(0)
+    genes = [str(i).encode() for i in range(100)]
+    disease = Series(random.randn(100), index=genes)
+    disease_profile = Profile(disease, limit=10)
+    signatures = DataFrame(random.randn(100, 30), index=genes, columns=[f'S{i}' for i in range(30)])
+    # reversal of the disease, and a signature with ties
+    signatures['S0'] = -disease
+    signatures['S1'] = signatures['S1'].round(0)
+
+    result = connectivity_significance(disease_profile, signatures, permutations=200, factor=-1, random_state=0)
+
+    assert list(result.columns) == ['score', 'ncs', 'p_value', 'fdr']
+    assert ((result.p_value >= 1 / 201) & (result.p_value <= 1)).all()
+    assert (result.fdr >= result.p_value).all()
+    assert result.loc['S0', 'score'] > 0 and result.loc['S0', 'p_value'] == 1 / 201
+    assert (sign(result.ncs) == sign(result.score)).all()
+
+    # signatures without ties share the null distribution; ties create separate groups
+    groups, ties = rank_groups(signatures)
+    assert groups[1] != groups[0] and (groups[2:] == groups[0]).all()
+
+    # null scores are the scores of the signatures against random tag sets
+    scorer = create_scorer(negative=True)
+    tag_positions = random_tag_positions(100, {'up': 10, 'down': 10}, 5, RandomState(1))
+    null = null_connectivity_scores(100, ties, tag_positions, {'up': 10, 'down': 10}, factor=-1)
+    for group, signature in enumerate(['S0', 'S1']):
+        # genes in the order of the sorted V(j)
+        ordered_genes = signatures[signature].rank(method='first').sort_values().index
+        for permutation in range(5):
+            random_disease = Series(0.0, index=genes)
+            random_disease[ordered_genes[tag_positions['up'][:, permutation]]] = 1
+            random_disease[ordered_genes[tag_positions['down'][:, permutation]]] = -1
+            expected = scorer(Profile(random_disease, limit=10), Profile(signatures[signature]))
+            assert null[group, permutation] == approx(expected)
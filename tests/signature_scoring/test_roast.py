@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from pandas import DataFrame
+
+import signature_scoring.scoring_functions.limma as limma
+
+
+def test_roast_prepare(monkeypatch):
+    roasted = []
+
+    def roast(expression, gene_sets, use_cache):
+        roasted.append(expression.name)
+        if expression.name == 'failing disease':
+            raise limma.RRuntimeError('roast failed')
+        return DataFrame({'fdr_q-val': [0.01, 0.5], 'score': [1.0, 2.0]}, index=['KEGG_A', 'KEGG_B'])
+
+    monkeypatch.setattr(limma, 'importr', lambda name: None)
+    monkeypatch.setattr(limma.db, 'load', lambda **kwargs: SimpleNamespace(gene_sets=[]))
+    monkeypatch.setattr(limma, 'roast', roast)
+
+    def expression(name, replicates=2):
+        columns = [f'{name} {i}' for i in range(replicates)]
+        return SimpleNamespace(name=name, cases=DataFrame(columns=columns), controls=DataFrame(columns=columns))
+
+    scorer = limma.create_roast_scorer(cache=False)
+
+    # a failed roast of the disease does not abort the run: none of the substances gets a score
+    assert scorer.prepare_disease(expression('failing disease')) is None
+    assert scorer(expression('failing disease'), expression('compound')) is None
+    assert 'compound' not in roasted
+
+    # the disease is roasted up front, even if the compound is then skipped
+    # for not having enough replicates to estimate the variance
+    roasted.clear()
+    assert scorer(expression('disease'), expression('compound', replicates=1)) is None
+    assert roasted == ['disease']
@@ -1,11 +1,23 @@
-from pandas import Series
-from pytest import approx
+from dataclasses import replace
 
-from signature_scoring.models import Profile
-from helpers.mathtools import split_to_pos_and_neg
+from numpy import array
+from numpy.random import RandomState
+from pandas import DataFrame, Series
+from pytest import approx, raises
+
+from signature_scoring import score_signatures
+from signature_scoring.models import Profile, SignaturesCollection
+from helpers.mathtools import split_to_pos_and_neg, top_positive_mask
 from helpers.cache import hash_series
+from helpers.pool import PersistentPool, shared_pool, shutdown_pool
 from signature_scoring.models import Signature
-from signature_scoring.scoring_functions.generic_scorers import score_spearman
+from signature_scoring.processor import SignatureProcessor
+from signature_scoring.processor.fold_change import FoldChangeSignature, FoldChangeSignatureProcessor
+from signature_scoring.scoring_functions.generic_scorers import (
+    score_spearman, changed_subsets, changed_subsets_sums, x_sum, x_product,
+    x_cos, spearman_correlations, cosine_distances
+)
+from signature_scoring.scoring_functions import scoring_function
 import signature_scoring.scoring_functions.connectivity_score as connectivity
 
 
@@ -57,6 +69,25 @@ def test_split():
     assert list(up.index) == ['I', 'H', 'G', 'F', 'E']
 
 
+def test_split_matrix():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(50)]
+    # rounding creates ties and zeros
+    signatures = DataFrame(random.randn(50, 10).round(1) * 2, index=genes)
+
+    for signature_type in [Signature, FoldChangeSignature]:
+        for limit in [5, 20, 100]:
+            down, up = signature_type.split_matrix(signatures.values, limit)
+            for i, signature in enumerate(signatures.columns):
+                expected_down, expected_up = signature_type(signatures[signature]).split(limit)
+                for positions, expected in [(down[i], expected_down), (up[i], expected_up)]:
+                    positions = positions[positions != -1]
+                    # the same genes are selected (the order of ties, e.g. of 0.8 and -0.8 in
+                    # the fold-change signatures which rank by magnitude, is not defined)
+                    assert {genes[p] for p in positions} == set(expected.index)
+                    assert sorted(signatures[signature].values[positions]) == sorted(expected.values)
+
+
 def test_hash():
     # identical objects have same hash
     assert hash_series(drug_1) == hash_series(drug_1)
@@ -88,3 +119,304 @@ def test_spearmanr():
 def test_cramer():
     assert connectivity.cramér_von_mises(disease, drug_1) == 50
     assert connectivity.cramér_von_mises(disease, disease) == 0
+
+
+def test_top_positive_mask():
+    values = array([
+        [3, 1, 2, 2, -5, 2],
+        [0, -1, -2, 0, 0, 0]
+    ])
+    # ties are resolved as in nlargest(keep='first')
+    assert top_positive_mask(values, 3).tolist() == [
+        [True, False, True, True, False, False],
+        [False, False, False, False, False, False]
+    ]
+
+
+def test_batch_x_scores():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    signatures = DataFrame(random.randn(100, 20).round(1), index=genes)
+    disease_profile = Profile(Series(random.randn(100), index=genes), limit=10)
+
+    sums = changed_subsets_sums(disease_profile.top, signatures, 10)
+
+    for i, signature in enumerate(signatures.columns):
+        compound_profile = Profile(signatures[signature], limit=10)
+        changed_by_compound, x_down_in_disease, x_up_in_disease = changed_subsets(
+            disease_profile.top, compound_profile.top
+        )
+        assert sums['up'][i] == approx(changed_by_compound[list(x_up_in_disease)].sum())
+        assert sums['down'][i] == approx(changed_by_compound[list(x_down_in_disease)].sum())
+        assert sums['down'][i] - sums['up'][i] == approx(x_sum(disease_profile, compound_profile))
+        assert -sums['down_product'][i] - sums['up_product'][i] == approx(x_product(disease_profile, compound_profile))
+
+
+def test_batch_spearman_and_cosine():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    disease_profile = Profile(Series(random.randn(100), index=genes), limit=10)
+    # as in the processor, the signatures are limited to the genes selected from the disease
+    selected_genes = [gene for gene in genes if gene in disease_profile.top.genes]
+    signatures = DataFrame(random.randn(len(selected_genes), 20).round(1), index=selected_genes)
+
+    correlations = spearman_correlations(disease_profile.top, signatures, 10)
+    distances = cosine_distances(disease_profile.top, signatures, 10)
+
+    for i, signature in enumerate(signatures.columns):
+        compound_profile = Profile(signatures[signature], limit=10)
+        spearman = correlations['down'][i] + correlations['up'][i]
+        assert spearman == approx(score_spearman(disease_profile, compound_profile), nan_ok=True)
+        assert distances['distance'][i] == approx(x_cos(disease_profile, compound_profile), nan_ok=True)
+
+
+def test_lazy_profile():
+    profile = Profile(disease, limit=1, parts=('top',))
+    assert profile._top is None
+
+    assert list(profile.top.up.index) == ['BRCA1']
+    assert profile.top._ranks is None
+
+    with raises(AttributeError):
+        profile.full
+
+    # without the limit, top and full are the same
+    profile = Profile(disease)
+    assert profile.top is profile.full
+
+
+def test_prepared_disease():
+    prepared = []
+
+    def prepare(disease_profile: Profile):
+        prepared.append(disease_profile)
+        return frozenset(disease_profile.top.up.index)
+
+    def shared_up_genes(up_genes: frozenset, compound_profile: Profile):
+        return len(up_genes & set(compound_profile.top.up.index))
+
+    scorer = scoring_function(shared_up_genes, prepare=prepare)
+    signatures = DataFrame({'drug_1': drug_1, 'drug_2': drug_2, 'drug_3': drug_3})
+
+    class Processor(SignatureProcessor):
+        # plain scores, not requiring the metadata of the signatures
+        scores_type = dict
+
+    scores = score_signatures(scorer, disease, signatures, limit=None, processes=1, processor_type=Processor)
+
+    # the disease is prepared once, and the prepared object is passed to each of the calls
+    assert len(prepared) == 1
+    assert scores == {'drug_1': 1, 'drug_2': 0, 'drug_3': 2}
+
+    # a direct call prepares the disease on its own
+    assert scorer(Profile(disease), Profile(drug_3)) == 2
+    assert len(prepared) == 2
+
+
+def test_prepared_disease_cache_warning():
+    warnings = []
+
+    def prepare(disease_profile: Profile, warn_about_cache=True):
+        warnings.append(warn_about_cache)
+        return frozenset(disease_profile.top.up.index)
+
+    def shared_up_genes(up_genes: frozenset, compound_profile: Profile):
+        return len(up_genes & set(compound_profile.top.up.index))
+
+    scorer = scoring_function(shared_up_genes, prepare=prepare, supports_cache=True)
+
+    # the cache warning is passed to prepare, not to func
+    assert scorer(Profile(disease), Profile(drug_3), warn_about_cache=False) == 2
+    assert scorer.prepare_disease(Profile(disease)) == frozenset(['BRCA1', 'B'])
+    assert warnings == [False, True]
+
+
+def test_parallelism():
+    assert scoring_function(x_sum.func).parallelism == 'processes'
+    assert scoring_function(x_sum.func, custom_multiprocessing=True).parallelism == 'serial'
+
+    with raises(AssertionError):
+        scoring_function(x_sum.func, parallelism='gpu')
+
+    class Processor(SignatureProcessor):
+        scores_type = dict
+
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    query = Series(random.randn(100), index=genes)
+    signatures = DataFrame(random.randn(100, 30), index=genes, columns=[f'S{i}' for i in range(30)])
+
+    scores = {
+        parallelism: score_signatures(
+            scoring_function(x_sum.func, parallelism=parallelism), query, signatures,
+            limit=10, processes=2, processor_type=Processor
+        )
+        for parallelism in ['serial', 'threads']
+    }
+    assert scores['threads'] == scores['serial']
+    assert len(scores['serial']) == 30
+
+
+class PlainScoresProcessor(SignatureProcessor):
+    # plain scores, not requiring the metadata of the signatures
+    scores_type = dict
+
+
+def test_processor_keeps_the_collection():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    signatures = DataFrame(random.randn(100, 20), index=genes, columns=[f'S{i}' for i in range(20)])
+    queries = [Series(RandomState(seed).randn(100), index=genes) for seed in range(2)]
+    scorer = replace(x_sum, batch=None)
+
+    processor = PlainScoresProcessor(SignaturesCollection(signatures), processes=1)
+    first, second = [processor.score_signatures(scorer, query, limit=10) for query in queries]
+
+    # the genes selected for the first query do not limit the second one
+    assert len(processor.signature_groups.genes) == 100
+    assert second == PlainScoresProcessor(SignaturesCollection(signatures), processes=1).score_signatures(
+        scorer, queries[1], limit=10
+    )
+
+
+def test_batch_scores_type():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    query = Series(random.randn(100), index=genes)
+    signatures = DataFrame(random.randn(100, 20), index=genes, columns=[f'S{i}' for i in range(20)])
+
+    # the batch engine returns plain scores: the processor builds its scores_type
+    # (the metadata of the signatures are not needed for a dict)
+    scores = score_signatures(x_sum, query, signatures, limit=10, processes=1, processor_type=PlainScoresProcessor)
+    assert type(scores) is dict
+    expected = score_signatures(
+        replace(x_sum, batch=None), query, signatures, limit=10, processes=1, processor_type=PlainScoresProcessor
+    )
+    assert scores == approx(expected)
+
+
+def test_pool_reused_between_queries(monkeypatch):
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    # the ids of all the signatures would exceed the limit of the payload sent to the workers
+    monkeypatch.setattr(PersistentPool, 'max_payload', 20000)
+    ids = [f'S{i}:' + 'x' * 1000 for i in range(30)]
+    signatures = DataFrame(random.randn(100, 30), index=genes, columns=ids)
+    scorer = scoring_function(x_sum.func)
+
+    try:
+        workers = None
+        for seed in range(2):
+            query = Series(RandomState(seed).randn(100), index=genes)
+            scores = score_signatures(
+                scorer, query, signatures, limit=10, processes=2, processor_type=PlainScoresProcessor
+            )
+            assert len(scores) == 30
+            if workers is None:
+                workers = shared_pool(2).workers
+            # each query is scored by a new processor, but the workers are not restarted
+            assert shared_pool(2).workers is workers
+    finally:
+        shutdown_pool()
+
+
+class PlainFoldChangesProcessor(FoldChangeSignatureProcessor):
+    scores_type = dict
+
+    def controls(self, selected_genes):
+        # the fold changes are the values of the signatures
+        return DataFrame(1.0, index=list(selected_genes), columns=self.ids)
+
+
+def test_fold_change_batch():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    query = Series(random.randn(100) * 3, index=genes)
+    signatures = DataFrame(random.randn(100, 20) * 3, index=genes, columns=[f'S{i}' for i in range(20)])
+    Processor = PlainFoldChangesProcessor
+
+    def up_regulated_in_batch(disease_profile, signatures, limit, split, **kwargs):
+        down, up = split(signatures.values, limit)
+        return {
+            signature: sorted(signatures.index[up[i][up[i] != -1]])
+            for i, signature in enumerate(signatures.columns)
+        }
+
+    def up_regulated(disease_profile, compound_profile):
+        return sorted(compound_profile.top.up.index)
+
+    scorer = scoring_function(up_regulated, batch=up_regulated_in_batch, profile_parts=('top',))
+    # without the limit all the genes are retained (rather than those selected in the query)
+    in_batch = score_signatures(scorer, query, signatures, limit=None, processes=1, processor_type=Processor)
+
+    # the fold-change rule (values above -1 are up-regulated) is used in the batch mode, not the signs
+    assert Processor.signature_type is FoldChangeSignature
+    for signature in signatures.columns:
+        expected = FoldChangeSignature(signatures[signature]).split(len(genes))[1]
+        assert in_batch[signature] == sorted(expected.index)
+        assert in_batch[signature] != sorted(signatures.index[signatures[signature] > 0])
+
+
+def test_fold_change_profiles():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    query = Series(random.randn(100) * 3, index=genes)
+    signatures = DataFrame(random.randn(100, 20) * 3, index=genes, columns=[f'S{i}' for i in range(20)])
+
+    def up_regulated(disease_profile, compound_profile):
+        # a single object per signature
+        return ' '.join(sorted(disease_profile.top.up.index)) + '|' + ' '.join(sorted(compound_profile.top.up.index))
+
+    scores = score_signatures(
+        scoring_function(up_regulated), query, signatures, limit=None, processes=1,
+        processor_type=PlainFoldChangesProcessor
+    )
+
+    # before the signature type of the processor was FoldChangeSignature, both the disease
+    # and the compound profiles were split by the sign (as Signature); now by the fold-change rule
+    expected_disease = sorted(FoldChangeSignature(query).split(len(genes))[1].index)
+    assert expected_disease != sorted(Signature(query).split(len(genes))[1].index)
+    for signature in signatures.columns:
+        disease_up, compound_up = [genes_list.split() for genes_list in scores[signature].split('|')]
+        assert disease_up == expected_disease
+        expected = FoldChangeSignature(signatures[signature]).split(len(genes))[1]
+        assert compound_up == sorted(expected.index)
+        assert compound_up != sorted(Signature(signatures[signature]).split(len(genes))[1].index)
+
+
+def test_fold_change_in_workers():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    query = Series(random.randn(100) * 3, index=genes)
+    signatures = DataFrame(random.randn(100, 30) * 3, index=genes, columns=[f'S{i}' for i in range(30)])
+    scorer = replace(x_sum, batch=None)
+
+    # the workers compute the fold changes with the controls of all the signatures
+    try:
+        in_workers = score_signatures(
+            scorer, query, signatures, limit=10, processes=2, processor_type=PlainFoldChangesProcessor
+        )
+    finally:
+        shutdown_pool()
+    assert in_workers == score_signatures(
+        scorer, query, signatures, limit=10, processes=1, processor_type=PlainFoldChangesProcessor
+    )
+
+
+def test_fold_change_batch_connectivity_scores():
+    random = RandomState(0)
+    genes = [f'G{i}' for i in range(100)]
+    query = Series(random.randn(100) * 3, index=genes)
+    signatures = DataFrame(random.randn(100, 20) * 3, index=genes, columns=[f'S{i}' for i in range(20)])
+
+    for ranks_type in ['disease', 'signature']:
+        scorer = connectivity.create_scorer(negative=True, ranks_type=ranks_type, compose_tags=connectivity.difference)
+        in_batch, per_signature = [
+            score_signatures(
+                scoring_func, query, signatures, limit=25, processes=1,
+                processor_type=PlainFoldChangesProcessor
+            )
+            for scoring_func in [scorer, replace(scorer, batch=None)]
+        ]
+        # the tags of the signatures are selected by the fold-change rule in both modes
+        assert in_batch == approx(per_signature)
@@ -0,0 +1,55 @@
+from threading import Thread
+
+from pandas import Index
+
+from signature_scoring.models.vocabulary import GeneVocabulary
+
+
+def test_vocabulary():
+    vocabulary = GeneVocabulary()
+
+    codes = vocabulary.encode([b'5720', b'466', b'6009'])
+    assert codes.dtype == 'int32'
+    assert list(codes) == [0, 1, 2]
+
+    # str and int ids are equivalent to the bytes ids
+    assert list(vocabulary.encode(['466', 5720, b'7015'])) == [1, 0, 3]
+    assert vocabulary.decode([3, 0]) == [b'7015', b'5720']
+
+    index = Index([b'7015', b'6009', b'1'])
+    assert vocabulary.encode(index) is vocabulary.encode(index)
+    assert list(vocabulary.isin(index, vocabulary.encode_set([6009, 7015]))) == [True, True, False]
+
+
+def test_vocabulary_index_cache():
+    vocabulary = GeneVocabulary(cached_indices=2)
+    index = Index([b'1', b'2'])
+    codes = vocabulary.encode(index)
+    assert not codes.flags.writeable
+    assert list(vocabulary.encode(index, cache=False)) == list(codes)
+
+    # the codes of an index are forgotten with the index (its id might be reused)
+    del index
+    assert not vocabulary.index_cache
+
+
+def test_vocabulary_threads():
+    vocabulary = GeneVocabulary()
+    genes = [str(i).encode() for i in range(2000)]
+    results = []
+
+    def encode(shift):
+        # the same new genes are added by all the threads at once, in different orders
+        results.append(dict(zip(genes[shift:] + genes[:shift], vocabulary.encode(genes[shift:] + genes[:shift]))))
+
+    threads = [Thread(target=encode, args=(shift,)) for shift in range(0, 2000, 250)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # each of the genes got a single code
+    assert len(vocabulary.genes) == 2000
+    assert sorted(vocabulary.codes.values()) == list(range(2000))
+    for codes in results:
+        assert codes == {gene: vocabulary.codes[gene] for gene in genes}
@@ -0,0 +1,47 @@
+from numpy import arange
+from pandas import Series
+
+from helpers.cache import BoundedCache, bounded_series_cache_decorator
+
+
+def test_bounded_cache():
+    cache = BoundedCache(max_bytes=2000)
+    for key in range(3):
+        cache.put(key, arange(100))    # 800 bytes each
+
+    # the least recently used entry was evicted
+    assert cache.get(0) is None
+    assert cache.get(1) is not None
+    cache.put(3, arange(100))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+
+    # values exceeding the budget are not stored
+    cache.put(4, arange(1000))
+    assert cache.get(4) is None
+
+    assert cache.info() == {
+        'hits': 2, 'misses': 3, 'evictions': 2,
+        'entries': 2, 'bytes': 1600, 'max_bytes': 2000
+    }
+
+    cache.resize(1000)
+    assert len(cache) == 1 and cache.evictions == 3
+
+    cache.clear()
+    assert len(cache) == 0 and cache.info()['hits'] == 0
+
+
+def test_bounded_series_cache_decorator():
+    calls = []
+
+    @bounded_series_cache_decorator(max_bytes=10 ** 6)
+    def head(series, n):
+        calls.append(n)
+        return series.head(n)
+
+    series = Series(range(10))
+    assert head(series, 2).equals(head(series, 2))
+    head(series, 3)
+    assert calls == [2, 3]
+    assert head.cache.info()['hits'] == 1
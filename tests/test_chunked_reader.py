@@ -0,0 +1,26 @@
+import numpy as np
+from h5py import File
+
+from data_sources.chunked_reader import ChunkedReader
+
+
+def test_read_block(tmp_path):
+    matrix = np.random.rand(1000, 30).astype('float32')
+
+    with File(tmp_path / 'matrix.h5', mode='w') as f:
+        f.create_dataset('matrix', data=matrix, chunks=(16, 10), compression='gzip')
+
+    with File(tmp_path / 'matrix.h5', mode='r') as f:
+        reader = ChunkedReader(f['matrix'], max_run_chunks=4)
+
+        sorted_indices = np.sort(np.random.choice(1000, 200, replace=False))
+        assert (reader.read_block(sorted_indices) == matrix[sorted_indices]).all()
+
+        # order of the requested indices is preserved, duplicates are allowed
+        indices = [999, 0, 17, 17, 16, 500]
+        assert (reader.read_block(indices) == matrix[indices]).all()
+
+        genes = [29, 3, 11]
+        assert (reader.read_block(indices, genes=genes) == matrix[indices][:, genes]).all()
+
+        assert reader.read_block([]).shape == (0, 30)
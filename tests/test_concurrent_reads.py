@@ -0,0 +1,42 @@
+from multiprocessing import get_context
+
+import numpy as np
+from h5py import File
+
+from data_sources.drug_connectivity_map import DrugConnectivityMap
+
+
+N_SIGNATURES = 2000
+N_GENES = 50
+
+dcm = None
+expected = None
+
+
+def read_random_blocks(seed):
+    random = np.random.RandomState(seed)
+    for _ in range(20):
+        indices = np.sort(random.choice(N_SIGNATURES, 100, replace=False))
+        if not (dcm.read_block(indices) == expected[indices]).all():
+            return False
+    return True
+
+
+def test_forked_workers_read_concurrently(tmp_path):
+    global dcm, expected
+    expected = np.random.rand(N_SIGNATURES, N_GENES).astype('float32')
+
+    dcm = DrugConnectivityMap(str(tmp_path))
+    with File(dcm.cmap_path, mode='w') as f:
+        f.create_dataset('0/DATA/0/matrix', data=expected, chunks=(50, N_GENES), compression='gzip')
+
+    # the file is opened in the parent process before forking
+    parent_file = dcm.cmap_file
+    assert (dcm.read_block([0, 5]) == expected[[0, 5]]).all()
+
+    with get_context('fork').Pool(16) as pool:
+        assert all(pool.map(read_random_blocks, range(64)))
+
+    # the parent keeps its own handle
+    assert dcm.cmap_file is parent_file
+    assert (dcm.read_block([1, 2]) == expected[[1, 2]]).all()
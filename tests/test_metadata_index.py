@@ -0,0 +1,24 @@
+from pandas import DataFrame
+
+from data_sources.metadata_index import MetadataIndex
+
+
+metadata = DataFrame({
+    'sig_id': ['a', 'b', 'c', 'd', 'e'],
+    'pert_iname': ['x', 'y', 'x', 'x', 'y'],
+    'cell_id': ['MCF7', 'MCF7', 'PC3', 'MCF7', 'PC3'],
+    'pert_time': [6, 24, 24, 24, 6]
+})
+
+
+def test_select():
+    index = MetadataIndex(metadata, columns=['pert_iname', 'cell_id'])
+
+    assert list(index.lookup('pert_iname', 'x')) == [0, 2, 3]
+    assert list(index.lookup('pert_iname', 'unknown')) == []
+
+    assert list(index.select(pert_iname='x', cell_id='MCF7')) == [0, 3]
+    # not indexed columns are scanned
+    assert list(index.select(pert_iname='x', pert_time=24)) == [2, 3]
+    # restricted to given positions
+    assert list(index.select(index.positions_of(['d', 'b', 'unknown']), cell_id='MCF7')) == [1, 3]
@@ -0,0 +1,137 @@
+from os import getpid
+from time import sleep
+
+from pytest import raises
+
+from helpers.pool import PersistentPool
+
+
+def worker_pid(item, offset):
+    return item + offset, getpid()
+
+
+def fail(item):
+    raise ValueError(f'failed on {item}')
+
+
+def test_persistent_pool():
+    pool = PersistentPool(2, progress_bar=False)
+    try:
+        results = list(pool.imap(worker_pid, range(10), shared_args=(1,)))
+        assert sorted(value for value, pid in results) == list(range(1, 11))
+        pids = {pid for value, pid in results}
+        assert getpid() not in pids
+
+        # the workers are reused
+        results = list(pool.imap(worker_pid, range(10), shared_args=(2,)))
+        assert {pid for value, pid in results} <= set(worker.pid for worker in pool.workers)
+        workers = pool.workers
+
+        # a closure cannot be pickled: it is inherited by the restarted workers
+        offset = 3
+        results = list(pool.imap(lambda item: (item + offset, getpid()), range(10)))
+        assert sorted(value for value, pid in results) == list(range(3, 13))
+        assert pool.workers is not workers
+
+        # the exceptions are raised in the calling process
+        with raises(ValueError, match='failed on'):
+            list(pool.imap(fail, range(3)))
+
+        # and the pool is still usable
+        assert len(list(pool.imap(worker_pid, range(5), shared_args=(0,)))) == 5
+    finally:
+        pool.shutdown()
+    assert not pool.is_running
+
+
+def test_registered_objects():
+    pool = PersistentPool(2, progress_bar=False)
+    try:
+        offsets = {'a': 1}
+        function = lambda item, offsets: item + offsets['a']
+        pool.register(function, offsets)
+        assert sorted(pool.imap(function, range(4), shared_args=(offsets,))) == [1, 2, 3, 4]
+        workers = pool.workers
+
+        # registered objects are passed by reference, without restarting the pool
+        assert sorted(pool.imap(function, range(4), shared_args=(offsets,))) == [1, 2, 3, 4]
+        assert pool.workers is workers
+    finally:
+        pool.shutdown()
+
+
+def slowly(items, delay):
+    for item in items:
+        sleep(delay)
+        yield item
+
+
+def test_idle_workers_keep_the_payload():
+    pool = PersistentPool(2, progress_bar=False)
+    pool.idle_timeout = 0.1
+    try:
+        # the workers idle between the tasks of the same call
+        results = pool.imap(worker_pid, slowly(range(4), delay=0.3), shared_args=(1,))
+        assert sorted(value for value, pid in results) == [1, 2, 3, 4]
+    finally:
+        pool.shutdown()
+
+
+def test_overlapping_calls():
+    pool = PersistentPool(2, progress_bar=False, task_timeout=10)
+    try:
+        inner = []
+
+        def items():
+            yield from range(2)
+            # another call starts before all the items of this one were sent
+            inner.append(pool.imap(worker_pid, range(3), shared_args=(10,)))
+            yield from range(2, 4)
+
+        outer = pool.imap(worker_pid, items(), shared_args=(1,))
+        assert sorted(value for value, pid in inner[0]) == [10, 11, 12]
+
+        # the workers cannot be restarted while the results of a call are awaited
+        with raises(RuntimeError, match='restarted'):
+            pool.imap(lambda item: item, range(2))
+
+        assert sorted(value for value, pid in outer) == [1, 2, 3, 4]
+    finally:
+        pool.shutdown()
+
+
+def test_stuck_workers():
+    pool = PersistentPool(2, progress_bar=False, task_timeout=0.5)
+    try:
+        with raises(RuntimeError, match='No result'):
+            list(pool.imap(sleep, [60]))
+        assert not pool.is_running
+
+        # the pool starts again on the next call
+        assert len(list(pool.imap(worker_pid, range(5), shared_args=(0,)))) == 5
+    finally:
+        pool.shutdown()
+
+
+class Unpicklable:
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.function = lambda item: item + offset
+
+    def shift(self, item):
+        return self.function(item)
+
+
+def test_bound_methods_of_unpicklable_objects():
+    pool = PersistentPool(2, progress_bar=False)
+    try:
+        instance = Unpicklable(1)
+        assert sorted(pool.imap(instance.shift, range(4))) == [1, 2, 3, 4]
+        workers = pool.workers
+
+        # the method is a new object on each access, but the pool is not restarted
+        assert sorted(pool.imap(instance.shift, range(4))) == [1, 2, 3, 4]
+        assert pool.workers is workers
+    finally:
+        pool.shutdown()
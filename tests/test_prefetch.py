@@ -0,0 +1,27 @@
+from pytest import raises
+
+from helpers.prefetch import Prefetcher
+
+
+def test_order_and_completion():
+    assert list(Prefetcher(range(100), depth=3)) == list(range(100))
+
+
+def test_errors_are_propagated():
+
+    def failing():
+        yield 1
+        raise ValueError('read failed')
+
+    items = Prefetcher(failing())
+    assert next(items) == 1
+    with raises(ValueError):
+        next(items)
+
+
+def test_close_releases_producer():
+    items = Prefetcher(iter(range(1000)), depth=1)
+    assert next(items) == 0
+    items.close()
+    items.thread.join(timeout=1)
+    assert not items.thread.is_alive()
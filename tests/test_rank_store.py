@@ -0,0 +1,63 @@
+import numpy as np
+from scipy.stats import rankdata
+
+from data_sources.drug_connectivity_map import dcm
+from data_sources.rank_store import RankStore
+from signature_scoring.models import SignaturesCollection
+from signature_scoring.processor import SignatureProcessor
+
+
+def test_rank_store(tmp_path):
+    # rounding introduces ties
+    matrix = np.random.RandomState(0).randn(20, 100).round(1)
+    genes = [str(i).encode() for i in range(20)]
+    signatures = [f'signature_{i}' for i in range(100)]
+
+    blocks = (matrix[:, start:start + 30] for start in range(0, 100, 30))
+    store = RankStore.convert(blocks, genes, signatures, tmp_path / RankStore.key(genes), progress=False)
+
+    assert RankStore.exists(tmp_path / RankStore.key(genes))
+    assert store.ranks.dtype == np.uint16
+    assert store.meta == {'dtype': None}
+
+    # the key does not depend on the order of the genes, nor on the type of the identifiers
+    assert RankStore.key(reversed(genes)) == RankStore.key(range(20))
+    assert RankStore.key(genes) != RankStore.key(genes[:10])
+
+    selected = ['signature_7', b'signature_3']
+    assert store.includes(selected) and not store.includes(['other'])
+
+    # genes in a different order
+    order = np.random.RandomState(1).permutation(20)
+    ranks = store.ascending_ranks(selected, [genes[i] for i in order])
+    assert (ranks == rankdata(matrix[:, [7, 3]], axis=0)[order]).all()
+
+
+def test_rank_store_suits(tmp_path):
+    matrix = np.random.RandomState(0).randn(20, 10).astype(np.float32)
+    genes = [str(i).encode() for i in range(20)]
+    signatures = [f'signature_{i}' for i in range(10)]
+
+    store = RankStore.convert([matrix], genes, signatures, tmp_path, dtype=matrix.dtype, progress=False)
+
+    assert store.suits(signatures[:3], np.float32)
+    assert not store.suits(['other'], np.float32)
+    # values cast to another precision may have other ties: the stored ranks do not apply
+    assert not store.suits(signatures[:3], np.float16)
+    assert not store.suits(signatures[:3], np.float64)
+
+
+def test_precomputed_ranks_of_cast_profiles(monkeypatch):
+    requested = []
+    monkeypatch.setattr(dcm, 'rank_store_for', lambda genes, signature_ids, dtype: requested.append(dtype))
+
+    genes = [str(i).encode() for i in range(20)]
+    collection = SignaturesCollection(
+        np.random.RandomState(0).randn(20, 10).astype(np.float16), index=genes
+    )
+    processor = SignatureProcessor(collection)
+    processor.precomputed_ranks(collection)
+    processor.precomputed_ranks(collection.astype(np.float32))
+
+    # the store is looked up for the type of the values in the collection
+    assert requested == [np.float16, np.float32]
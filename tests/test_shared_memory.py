@@ -0,0 +1,45 @@
+import pickle
+from multiprocessing import get_context
+
+import numpy as np
+from pandas import DataFrame
+
+from helpers.shared_memory import SharedArray
+from signature_scoring.models import SignaturesCollection
+from signature_scoring.models.shared import SharedSignaturesCollection
+
+
+def total(shared: SharedArray):
+    return shared.array.sum()
+
+
+def test_shared_array():
+    array = np.arange(10000, dtype=float)
+    with SharedArray(array) as shared:
+        data = pickle.dumps(shared)
+        # only the name of the memory block is sent
+        assert len(data) < 500
+
+        attached = pickle.loads(data)
+        attached.array[0] = 100
+        assert shared.array[0] == 100
+        attached.close()
+
+        with get_context('fork').Pool(2) as pool:
+            assert pool.map(total, [shared, shared]) == [shared.array.sum()] * 2
+
+
+def test_shared_signatures_collection():
+    genes = [str(i).encode() for i in range(50)]
+    collection = SignaturesCollection(
+        np.random.RandomState(0).randn(50, 20).astype('float16'),
+        index=genes, columns=[f'S{i}' for i in range(20)]
+    )
+    with SharedSignaturesCollection.from_collection(collection) as shared:
+        attached = pickle.loads(pickle.dumps(shared))
+        assert list(attached.genes) == genes
+        assert 'S3' in attached.groups_keys() and 'other' not in attached.groups_keys()
+        assert attached['S3'].equals(collection['S3'])
+        assert attached['S3'].name == 'S3'
+        assert attached.drop_signatures(['S3']).equals(collection.drop(columns=['S3']))
+        attached.close()
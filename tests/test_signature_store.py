@@ -0,0 +1,35 @@
+import numpy as np
+from h5py import File
+
+from data_sources.signature_store import SignatureStore
+
+
+def test_conversion(tmp_path):
+    matrix = np.random.rand(100, 20).astype('float32')
+    genes = np.array([str(i).encode() for i in range(20)])
+    signatures = np.array([f'signature_{i}'.encode() for i in range(100)])
+
+    with File(tmp_path / 'matrix.h5', mode='w') as f:
+        f.create_dataset('matrix', data=matrix, chunks=(8, 20), compression='gzip')
+
+    with File(tmp_path / 'matrix.h5', mode='r') as f:
+        store = SignatureStore.convert(
+            f['matrix'], genes, signatures, tmp_path / 'store',
+            block_size=30, progress=False
+        )
+
+    assert SignatureStore.exists(tmp_path / 'store')
+    assert (store.genes == genes).all()
+    assert (store.signatures == signatures).all()
+
+    # contiguous rows are views of the memmap
+    assert np.shares_memory(store.row(7), store.matrix)
+    assert np.shares_memory(store.rows([3, 4, 5]), store.matrix)
+    assert (store.rows([3, 4, 5]) == matrix[3:6]).all()
+
+    # scattered rows are gathered
+    assert (store.rows([1, 5, 9]) == matrix[[1, 5, 9]]).all()
+
+    # unsorted (even if spanning a contiguous range) and repeated indices keep their order
+    assert (store.rows([0, 2, 1, 3]) == matrix[[0, 2, 1, 3]]).all()
+    assert (store.rows([4, 4, 5]) == matrix[[4, 4, 5]]).all()